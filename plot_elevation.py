@@ -51,12 +51,9 @@ Y = np.linspace(6175012.5, 6250012.5, num=100)
 X = np.linspace(500000.0, 505000.0, num=200)
 Y = np.linspace(6187500.0, 6192500.0, num=200)
 
-Z = np.zeros((len(X), len(Y)))
-for x in range(len(X)):
-    for y in range(len(Y)):
-        Z[x, y] = elevation_map.get_elevation(np.array([X[x], Y[y]]))
-print(Z)
 Y, X = np.meshgrid(Y, X)
+Z = elevation_map.get_elevations(np.stack((X.ravel(), Y.ravel()), axis=-1)).reshape(X.shape)
+print(Z)
 fig = plt.figure()
 fig2 = plt.figure()
 ax2 = fig2.gca(aspect='equal')
@@ -23,17 +23,62 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import functools
+import itertools
 import logging
+import math
 from collections.abc import Sequence
 
 import numpy as np
 from affine import Affine
-from osgeo import gdal
+from osgeo import gdal, gdal_array
 
-from fire_rs.geodata.geo_data import GeoData, join_structured_arrays
+from fire_rs.geodata.geo_data import GeoData
+
+try:
+    import numba
+except ImportError:  # optional, point sampling falls back to NumPy
+    numba = None
 
 logger = logging.getLogger(__name__)
 
+# flags set by point sampling
+_OUTSIDE = 1
+_NODATA = 2
+
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _sample_band(xs, ys, band, a, b, c, d, e, f, nodata, fill, has_fill, out, flags):
+        """Sample a band at projected points (xs, ys) given the inverse transform coefficients.
+
+        Values are written in out; points outside the band or with NODATA are flagged in flags.
+        """
+        nx, ny = band.shape
+        for k in numba.prange(xs.size):
+            # same rounding as RasterTile.projected_to_raster
+            xr = int(a * xs[k] + b * ys[k] + c - 0.5)
+            yr = int(d * xs[k] + e * ys[k] + f - 0.5)
+            if 0 <= xr < nx and 0 <= yr < ny:
+                v = band[xr, yr]
+                if v == nodata or abs(v - nodata) <= 1e-8 + 1e-5 * abs(nodata):  # as np.isclose
+                    flags[k] |= _NODATA
+                    if has_fill:
+                        v = fill
+                out[k] = v
+            else:
+                flags[k] |= _OUTSIDE
+
+
+@functools.lru_cache(maxsize=256)
+def _open_ds(path):
+    """Open a raster file, reusing the GDAL dataset of previous openings.
+
+    GDAL datasets are not thread-safe: a shared handle must not be read from several threads.
+    """
+    handle = gdal.Open(path)
+    if handle is None:  # not cached, a later call retries
+        raise IOError("Unable to open {}".format(path))
+    return handle
+
 
 # There are 3 sets of coordinates (spaces) for every location. A position in the geographic space,
 # expressed in GPS coordinates (WGS84 system); a position in the projected space, expressed in
@@ -42,20 +87,159 @@ logger = logging.getLogger(__name__)
 # https://libraries.mit.edu/files/gis/DEM2013.pdf Slides explaining DEMs, slope calculation...
 # Another projected space is UTM
 
+class _TileGrid:
+    """Index of tiles laid out on a regular grid, in uniform buckets as large as a tile.
+
+    As a tile also claims positions lying up to half a cell beyond its borders, it is registered
+    in every bucket touched by its borders extended by one cell. Within a bucket, tiles keep the
+    lookup order so that a lookup returns the same tile as a linear scan would.
+    """
+
+    def __init__(self, tiles):
+        self._buckets = {}
+        self._origin = (min(t.border_x_min for t in tiles), min(t.border_y_min for t in tiles))
+        self._cell_size = (min(t.border_x_max - t.border_x_min for t in tiles),
+                           min(t.border_y_max - t.border_y_min for t in tiles))
+        for tile in tiles:
+            margin_x, margin_y = abs(tile.x_delta), abs(tile.y_delta)
+            i_min, j_min = self._bucket_key((tile.border_x_min - margin_x,
+                                             tile.border_y_min - margin_y))
+            i_max, j_max = self._bucket_key((tile.border_x_max + margin_x,
+                                             tile.border_y_max + margin_y))
+            for key in itertools.product(range(i_min, i_max + 1), range(j_min, j_max + 1)):
+                self._buckets.setdefault(key, []).append(tile)
+
+    @staticmethod
+    def fits(tiles, rel_tol=1e-6):
+        """Whether tiles have the same size and are aligned on a common grid."""
+        width = tiles[0].border_x_max - tiles[0].border_x_min
+        height = tiles[0].border_y_max - tiles[0].border_y_min
+        x_origin, y_origin = tiles[0].border_x_min, tiles[0].border_y_min
+        for t in tiles:
+            if not (math.isclose(t.border_x_max - t.border_x_min, width, rel_tol=rel_tol) and
+                    math.isclose(t.border_y_max - t.border_y_min, height, rel_tol=rel_tol)):
+                return False
+            x_steps = (t.border_x_min - x_origin) / width
+            y_steps = (t.border_y_min - y_origin) / height
+            if abs(x_steps - round(x_steps)) > rel_tol or abs(y_steps - round(y_steps)) > rel_tol:
+                return False
+        return True
+
+    def _bucket_key(self, position):
+        """Get the index of the bucket where a position falls."""
+        return (int(math.floor((position[0] - self._origin[0]) / self._cell_size[0])),
+                int(math.floor((position[1] - self._origin[1]) / self._cell_size[1])))
+
+    def candidates(self, position):
+        """Get the tiles that may contain a position, in lookup order."""
+        return self._buckets.get(self._bucket_key(position), ())
+
+    def candidate_groups(self, positions):
+        """Split an (N, 2) array of positions, as (indices, candidate tiles) pairs."""
+        keys = np.floor((positions - self._origin) / self._cell_size).astype(np.intp)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique_keys) + 1))
+        for k, key in enumerate(unique_keys):
+            yield order[bounds[k]:bounds[k + 1]], self._buckets.get(tuple(key), ())
+
+
+class _TileKDTree:
+    """Index of tiles of any size and layout, as a KD-tree of their centers.
+
+    The candidates of a position are the tiles whose center is closer than the largest
+    half-diagonal of a tile (borders extended by one cell), which cannot miss a containing tile.
+    """
+
+    def __init__(self, tiles):
+        from scipy.spatial import cKDTree  # only needed by irregular maps, slow to import
+
+        self._tiles = tiles
+        centers = [((t.border_x_min + t.border_x_max) / 2, (t.border_y_min + t.border_y_max) / 2)
+                   for t in tiles]
+        self._tree = cKDTree(centers)
+        self._radius = max(math.hypot((t.border_x_max - t.border_x_min) / 2 + abs(t.x_delta),
+                                      (t.border_y_max - t.border_y_min) / 2 + abs(t.y_delta))
+                           for t in tiles)
+
+    def candidates(self, position):
+        """Get the tiles that may contain a position, in lookup order."""
+        return [self._tiles[i]
+                for i in sorted(self._tree.query_ball_point((position[0], position[1]),
+                                                            self._radius))]
+
+    def candidate_groups(self, positions):
+        """Split an (N, 2) array of positions, as (indices, candidate tiles) pairs."""
+        # irregular maps have few tiles, each of them is tested on all positions at once
+        yield np.arange(len(positions)), self._tiles
+
+
 class DigitalMap:
-    """Abstract representation of a set of tiles."""
+    """Abstract representation of a set of tiles.
+
+    Finding the tile of a position takes constant time when tiles are laid out on a regular grid,
+    which is the case of maps made of DEM tiles. Other layouts are indexed by a KD-tree.
+    Tiles are only arranged and indexed when the map is next used, once for any number of tiles
+    added in between.
+    """
 
     def __init__(self, tiles):
         """Initialise DigitalMap. Tiles should entirely cover a rectangular area."""
-        self._tiles = [[]]  # a 2D-array of tiles, covering a rectangular area
+        self._tile_list = []  # tiles in the order they were added
+        self._arranged_tiles = None  # self._tile_list arranged by _arrange_tiles, once needed
+        self._tile_index = None  # index of the tiles that may contain a position, once needed
         for tile in tiles:
             self.add_tile(tile)
 
     def add_tile(self, tile):
         """Add a tile to the map."""
-        # gather all tiles and sort them by increasing (x, y)
-        all_tiles = [t for ts in self._tiles for t in ts] + [tile]
-        self._tiles = DigitalMap._arrange_tiles(all_tiles)
+        self._tile_list.append(tile)
+        self._arranged_tiles = None
+        self._tile_index = None
+
+    @property
+    def _tiles(self):
+        """A 2D-array of tiles sorted by increasing (x, y), covering a rectangular area."""
+        if self._arranged_tiles is None:
+            self._arranged_tiles = DigitalMap._arrange_tiles(self._tile_list)
+        return self._arranged_tiles
+
+    @property
+    def _index(self):
+        """Index of the tiles, a grid if they are regular or a KD-tree otherwise."""
+        if self._tile_index is None and self._tile_list:
+            all_tiles = [t for ts in self._tiles for t in ts]
+            if _TileGrid.fits(all_tiles):
+                self._tile_index = _TileGrid(all_tiles)
+            else:
+                self._tile_index = _TileKDTree(all_tiles)
+        return self._tile_index
+
+    def _candidate_tiles(self, position):
+        """Get the tiles that may contain a position, in lookup order."""
+        index = self._index
+        return index.candidates(position) if index is not None else ()
+
+    def _group_by_tile(self, positions):
+        """Dispatch an (N, 2) array of positions to the tiles where they are defined.
+
+        :return: a list of (tile, indices) pairs, indices being the rows of positions that the
+            tile is in charge of. Positions outside the map appear in no pair.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        index = self._index
+        if index is None or len(positions) == 0:
+            return []
+        groups = {}
+        for pending, candidates in index.candidate_groups(positions):
+            for tile in candidates:
+                if len(pending) == 0:
+                    break
+                inside = tile.contains_points(positions[pending, 0], positions[pending, 1])
+                groups.setdefault(tile, []).append(pending[inside])
+                pending = pending[~inside]
+        return [(tile, np.concatenate(idx)) for tile, idx in groups.items()]
 
     @staticmethod
     def _arrange_tiles(tile_list):
@@ -77,12 +261,16 @@ class DigitalMap:
         """Get the pixel size of the underlying tiles (assuming square pixels)"""
         return self._tiles[0][0].x_delta
 
-    def get_value(self, position):
-        """Get the value corresponding to a position."""
-        for horizontal_tiles in self._tiles:
-            for tile in horizontal_tiles:
-                if position in tile:
-                    return tile[position]
+    def get_value(self, x, y=None):
+        """Get the value corresponding to a position, given as (x, y) or as two scalars."""
+        if y is None:
+            x, y = x[0], x[1]
+        position = (x, y)
+        for tile in self._candidate_tiles(position):
+            # a single transform per tile for both the bounds check and the access
+            xr, yr = tile._projected_to_raster_nocheck(position)
+            if 0 <= xr < tile.raster_size[0] and 0 <= yr < tile.raster_size[1]:
+                return tile._raster_value(xr, yr)
 
     def get_values(self, positions_intervals):
         ((x_min, x_max), (y_min, y_max)) = positions_intervals
@@ -127,30 +315,31 @@ class DigitalMap:
 
     def __contains__(self, position):
         """Whether a position is defined in the map."""
-        for horizontal_tiles in self._tiles:
-            for tile in horizontal_tiles:
-                if position in tile:
-                    return True
+        for tile in self._candidate_tiles(position):
+            if position in tile:
+                return True
         return False
 
     def tile_of_location(self, position):
         """Get the tile where the position is defined."""
-        for horizontal_tiles in self._tiles:
-            for tile in horizontal_tiles:
-                if position in tile:
-                    return tile
-        raise KeyError("Location {} not in {}".format(position, self))
+        for tile in self._candidate_tiles(position):
+            if position in tile:
+                return tile
+        raise KeyError("Location %s not in map" % (position,))
 
 
 class RasterTile:
 
-    def __init__(self, filenames, bands_names_types, nodata_fill=None):
+    def __init__(self, filenames, bands_names_types, nodata_fill=None, float_storage=None):
         """Initialise RasterTile.
 
         It stores the metadata during the initilization. Data loading is lazy.
 
         :param filenames: One or more file names corresponding to the same tile.
         :param nodata_fill: Array of of size equal to the total number of bands
+        :param float_storage: Type used to store the bands declared as float. By default, float32
+            unless the source needs more (e.g. Float64). np.float16 halves memory again, at the
+            cost of precision (about 0.5 m for elevations of 1000 m).
         """
         if isinstance(filenames, str):
             filenames = [filenames]
@@ -166,9 +355,10 @@ class RasterTile:
 
         n_bands = 0
         nodata_values = []
+        source_types = []
 
         # First file
-        handle = gdal.Open(filenames[0])
+        handle = _open_ds(filenames[0])
         self.geoprojection = handle.GetProjection()
         self.raster_size = np.array([handle.RasterXSize, handle.RasterYSize])
         self.raster_offset = np.array([0, 0])
@@ -182,6 +372,10 @@ class RasterTile:
         self.x_delta = self.geotransform[1]
         self.y_delta = self.geotransform[5]
         self.inverse_transform = ~self.direct_transform
+        # coefficients of the inverse transform, as plain floats for inline arithmetic
+        self._inv = tuple(float(k) for k in self.inverse_transform[:6])
+        # and as a matrix applying to homogeneous (x, y, 1) points
+        self._inv_mat = np.array([self._inv[0:3], self._inv[3:6]], dtype=np.float64)
         topleft_projection_corner = (self.direct_transform.c, self.direct_transform.f)
         bottomright_projection_corner = self.direct_transform * (self.raster_size)
 
@@ -201,15 +395,19 @@ class RasterTile:
         n_bands += handle.RasterCount
         for i in range(handle.RasterCount):  # Bands start at 1
             nodata_values.append(handle.GetRasterBand(i + 1).GetNoDataValue())
+            source_types.append(gdal_array.GDALTypeCodeToNumericTypeCode(
+                handle.GetRasterBand(i + 1).DataType))
 
         # Process the rest of files
         for f in self.filenames[1:]:
-            handle = gdal.Open(f)
+            handle = _open_ds(f)
             if handle.GetProjection() == self.geoprojection and \
                     handle.GetGeoTransform() == self.geotransform:
                 n_bands += handle.RasterCount
                 for i in range(handle.RasterCount):  # Bands start at 1
                     nodata_values.append(handle.GetRasterBand(i + 1).GetNoDataValue())
+                    source_types.append(gdal_array.GDALTypeCodeToNumericTypeCode(
+                        handle.GetRasterBand(i + 1).DataType))
             else:
                 raise ValueError("Only bands with the same projection can be added.")
 
@@ -217,30 +415,70 @@ class RasterTile:
             "Number of bands in files ({}) did not match the declared ones: {}".format(
                 n_bands, bands_names_types)
 
-        # Set data array size
+        # Bands are exposed with the declared types but stored with the type of their source
+        # (only widened to float when a float is declared), allocation being deferred to loading
+        self._dtype = np.dtype(list(bands_names_types))
+        if float_storage is None:
+            float_types = [np.promote_types(source, np.float32) for source in source_types]
+        else:
+            float_types = [np.dtype(float_storage)] * len(source_types)
+        self._storage_dtype = np.dtype(
+            [(name, float_type if np.issubdtype(t, np.floating) else source)
+             for (name, t), source, float_type in zip(bands_names_types, source_types,
+                                                      float_types)])
         self._bands = None
         self._loaded = False
-        self.nodata_values = np.array(nodata_values)
+        # bands without NODATA compare to NaN, which never matches
+        self.nodata_values = np.array([np.nan if v is None else v for v in nodata_values],
+                                      dtype=np.float64)
+        # compare to NODATA as stored, e.g. -99999 becomes -inf in float16
+        with np.errstate(over='ignore'):
+            for i, name in enumerate(self._storage_dtype.names):
+                if np.issubdtype(self._storage_dtype[name], np.floating):
+                    self.nodata_values[i] = self._storage_dtype[name].type(self.nodata_values[i])
+
+        if len(self.bands_names_types) == 1:
+            # most tiles (elevation, land cover) have a single band; use a scalar access for them
+            self._raster_value = self._raster_value_single_band
 
     def _load_data(self):
         """Load data from files."""
+        self._bands = np.empty(tuple(self.raster_size), dtype=self._storage_dtype)
         curr_layer = 0  # tracks the layer we are currently looking at
-        layers = []  # a sequence of structured arrays: one by layer
         for i in range(len(self.filenames)):
-            handle = gdal.Open(self.filenames[i])
-            for j in range(handle.RasterCount):  # Bands start at 1
-                layer = np.array(handle.GetRasterBand(j + 1).ReadAsArray(),
-                                 dtype=[self.bands_names_types[curr_layer]])
-                # make x the first index and y the second, keeping the C ordering
-                layer = np.array(layer.transpose(), order='C')
-                layers.append(layer)
-                curr_layer += 1
+            handle = _open_ds(self.filenames[i])
+            names = [n for n, _ in self.bands_names_types[curr_layer:curr_layer + handle.RasterCount]]
+            storage_types = {self._storage_dtype[n] for n in names}
+            if any(gdal_array.NumericTypeCodeToGDALTypeCode(t.type) is None
+                   for t in storage_types):
+                # no GDAL counterpart (e.g. float16): read with the source type and convert,
+                # a NODATA out of the storage range becoming infinite
+                with np.errstate(over='ignore'):
+                    for j, name in enumerate(names):  # Bands start at 1
+                        self._bands[name] = handle.GetRasterBand(j + 1).ReadAsArray().transpose()
+            elif len(storage_types) == 1:
+                # a single read for all the bands of the file, straight into their fields
+                handle.ReadAsArray(buf_obj=self._raster_view(names))
+            else:
+                for j, name in enumerate(names):  # Bands start at 1
+                    handle.GetRasterBand(j + 1).ReadAsArray(buf_obj=self._bands[name].transpose())
+            curr_layer += handle.RasterCount
 
         assert curr_layer == len(self.bands_names_types), "Less layers that expected"
-        assert all(l.shape == layers[0].shape for l in layers), "Layers do not have a uniform shape"
-        self._bands = join_structured_arrays(layers)
         self._loaded = True
 
+    def _raster_view(self, names):
+        """View of consecutive fields of the same type in the (band, line, pixel) order of GDAL.
+
+        The band axis is dropped for a single field.
+        """
+        field_type, offset = self._storage_dtype.fields[names[0]][:2]
+        view = np.ndarray(shape=(len(names), self._bands.shape[1], self._bands.shape[0]),
+                          dtype=field_type, buffer=self._bands, offset=offset,
+                          strides=(field_type.itemsize,
+                                   self._bands.strides[1], self._bands.strides[0]))
+        return view[0] if len(names) == 1 else view
+
     @property
     def data(self):
         if not self._loaded:
@@ -257,17 +495,80 @@ class RasterTile:
 
     def __contains__(self, item):
         """Test if projected location is represented in this tile."""
-        # TODO: Implement a faster way
-        try:
-            self.projected_to_raster(item)
-            return True
-        except KeyError:
-            return False
-
-    def get_value(self, location):
-        """Get value of projected location."""
-        p = self.projected_to_raster(location)
-        value = self.data[p[0], p[1]]
+        xr, yr = self._projected_to_raster_nocheck(item)
+        return 0 <= xr < self.raster_size[0] and 0 <= yr < self.raster_size[1]
+
+    def contains_points(self, xs, ys):
+        """Boolean mask of the projected points (xs, ys) represented in this tile."""
+        return self.projected_to_raster_vec(xs, ys)[2]
+
+    def get_point_values(self, xs, ys, bands=None):
+        """Get the values at the projected points (xs, ys), as a structured array of their bands.
+
+        All points must be in the tile.
+
+        :param bands: Names of the bands to sample, all of them by default. Bands are gathered
+            one at a time, so the fields that are not asked for are not read.
+        """
+        names = self._dtype.names if bands is None else tuple(bands)
+        band_ids = [self._dtype.names.index(name) for name in names]
+        dtype = np.dtype([(name, self._dtype[name]) for name in names])
+        nodata_values = self.nodata_values[band_ids]
+        nodata_fill = [self.nodata_fill[i] for i in band_ids] if self.nodata_fill else None
+        # Numba does not handle float16 arrays
+        if numba is not None and all(self._storage_dtype[name] != np.float16 for name in names):
+            xs = np.ascontiguousarray(xs, dtype=np.float64).reshape(-1)
+            ys = np.ascontiguousarray(ys, dtype=np.float64).reshape(-1)
+            values = np.empty(xs.shape, dtype=dtype)
+            flags = np.zeros(xs.shape, dtype=np.uint8)
+            for i, name in enumerate(names):
+                _sample_band(xs, ys, self.data[name], *self._inv, nodata_values[i],
+                             nodata_fill[i] if nodata_fill else 0., bool(nodata_fill),
+                             values[name], flags)
+            if (flags & _OUTSIDE).any():
+                raise KeyError("Location out of this tile bounds")
+            nd_locations = (flags & _NODATA) != 0
+        else:
+            xr, yr, inside = self.projected_to_raster_vec(xs, ys)
+            if not inside.all():
+                raise KeyError("Location out of this tile bounds")
+            values = np.empty(xr.shape, dtype=dtype)
+            for name in names:
+                values[name] = self.data[name][xr, yr]
+
+            # NODATA test, on a (N, n_bands) view of the values
+            raw = np.stack([values[name] for name in names], axis=-1).astype(np.float64)
+            nd = np.isclose(raw, nodata_values)
+            nd_locations = nd.any(axis=1)
+            if nd.any() and nodata_fill:
+                raw = np.where(nd, nodata_fill, raw)
+                for i, name in enumerate(names):
+                    values[name] = raw[:, i]
+
+        if nd_locations.any():
+            if not nodata_fill:
+                logger.warning("NODATA at %d locations in %s but no fill has been defined",
+                               np.count_nonzero(nd_locations), self)
+            else:
+                logger.warning("NODATA at %d locations in %s filled with %s",
+                               np.count_nonzero(nd_locations), self, nodata_fill)
+        return values
+
+    def get_value(self, x, y=None):
+        """Get value of projected location, given as (x, y) or as two scalars."""
+        if y is None:
+            x, y = x[0], x[1]
+        xr, yr = self._projected_to_raster_nocheck((x, y))
+        if not (0 <= xr < self.raster_size[0] and 0 <= yr < self.raster_size[1]):
+            raise KeyError("Location out of this tile bounds")
+        return self._raster_value(xr, yr)
+
+    def _raster_value(self, xr, yr):
+        """Get value of a raster point of this tile."""
+        if self._storage_dtype == self._dtype:
+            value = self.data[xr, yr]
+        else:
+            value = self.data[xr, yr:yr + 1].astype(self._dtype)[0]
 
         # NODATA test
         nd = np.isclose(value.tolist(), self.nodata_values)
@@ -275,18 +576,33 @@ class RasterTile:
             if not self.nodata_fill:
                 # No replacement for NODATA
                 logger.warning("Location %s in %s has NODATA but no fill has been defined",
-                               (p[0], p[1]), self)
+                               (xr, yr), self)
             else:
-                for i in range(len(nd)):
-                    if nd:
-                        logger.warning("Location %s of band %s in %s with %s",
-                                       (p[0], p[1]), i, self, self.nodata_fill[i])
-                        value[i] = self.nodata_fill[i]
+                logger.warning("Location %s of bands %s in %s with %s",
+                               (xr, yr), np.flatnonzero(nd), self, self.nodata_fill)
+                filled = np.where(nd, self.nodata_fill, value.tolist())
+                # new value rather than in-place write, which would alter the tile data
+                value = np.array(tuple(filled), dtype=self._dtype)[()]
         if len(value) == 1:
             return value[0]  # Extract if there is a single value
         else:
             return value
 
+    def _raster_value_single_band(self, xr, yr):
+        """Get value of a raster point of this tile, for tiles with a single band."""
+        v = self.data[self._dtype.names[0]][xr, yr]
+        nodata = self.nodata_values[0]
+        if v == nodata or abs(v - nodata) <= 1e-8 + 1e-5 * abs(nodata):  # as np.isclose
+            if not self.nodata_fill:
+                # No replacement for NODATA
+                logger.warning("Location %s in %s has NODATA but no fill has been defined",
+                               (xr, yr), self)
+            else:
+                logger.warning("Location %s of bands %s in %s with %s",
+                               (xr, yr), [0], self, self.nodata_fill)
+                v = self.nodata_fill[0]
+        return self._dtype[0].type(v).item()
+
     def as_geo_data(self):
         return self.get_values(((self.x_min, self.x_max), (self.y_min, self.y_max)))
 
@@ -303,7 +619,7 @@ class RasterTile:
             xi_min, yi_min = self.projected_to_raster((x_min, y_min))
             xi_max, yi_max = self.projected_to_raster((x_max, y_max))
             # returns the subarray
-            subarray = self.data[xi_min:xi_max + 1, yi_min:yi_max + 1]
+            subarray = self._as_declared(self.data[xi_min:xi_max + 1, yi_min:yi_max + 1])
             return GeoData(subarray, *self.raster_to_projected((xi_min, yi_min)),
                            self.x_delta, self.y_delta, projection=self.geoprojection)
         else:  # our internal data structure is inversed on y-axis
@@ -311,10 +627,15 @@ class RasterTile:
             xi_min, yi_min = self.projected_to_raster((x_min, y_max))
             xi_max, yi_max = self.projected_to_raster((x_max, y_min))
             # returns the sub-array, inversed on the y-axis
-            subarray = self.data[xi_min:xi_max + 1, yi_min:yi_max + 1][..., ::-1]
+            subarray = self._as_declared(
+                self.data[xi_min:xi_max + 1, yi_min:yi_max + 1][..., ::-1])
             return GeoData(subarray, *self.raster_to_projected((xi_min, yi_max)),
                            self.x_delta, -self.y_delta, projection=self.geoprojection)
 
+    def _as_declared(self, array):
+        """View or copy of a piece of the stored data with the declared band types."""
+        return array if array.dtype == self._dtype else array.astype(self._dtype)
+
     def raster_to_projected(self, loc):
         """Return the projected location of a pixel point in this tile."""
         if loc[0] in range(0, self.raster_size[0]) and loc[1] in range(0, self.raster_size[1]):
@@ -327,14 +648,31 @@ class RasterTile:
 
     def projected_to_raster(self, loc):
         """Return the raster point of a projected location in this tile."""
-        xr, yr = self.inverse_transform * (loc[0], loc[1])
-        xr, yr = int(xr - 0.5), int(yr - 0.5)
-
-        if xr in range(0, self.raster_size[0]) and yr in range(0, self.raster_size[1]):
+        xr, yr = self._projected_to_raster_nocheck(loc)
+        if 0 <= xr < self.raster_size[0] and 0 <= yr < self.raster_size[1]:
             return np.array([xr, yr])
         else:
             raise KeyError("Location out of this tile bounds")
 
+    def _projected_to_raster_nocheck(self, loc):
+        """Return the raster point of a projected location, whether in this tile or not."""
+        a, b, c, d, e, f = self._inv
+        return int(a * loc[0] + b * loc[1] + c - 0.5), int(d * loc[0] + e * loc[1] + f - 0.5)
+
+    def projected_to_raster_vec(self, xs, ys):
+        """Return the raster points of projected locations (xs, ys) in this tile.
+
+        :return: (xr, yr, mask) integer arrays of raster coordinates and boolean array telling
+            which locations are in the tile. Coordinates are meaningless where mask is False.
+        """
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=np.float64),
+                                     np.asarray(ys, dtype=np.float64))
+        points = np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+        # same rounding as projected_to_raster: int() truncates toward zero
+        xr, yr = np.trunc(self._inv_mat @ points - 0.5).reshape((2,) + xs.shape)
+        mask = (0 <= xr) & (xr < self.raster_size[0]) & (0 <= yr) & (yr < self.raster_size[1])
+        return xr.astype(np.intp), yr.astype(np.intp), mask
+
     def nearest_projected_point(self, loc):
         """Return the (projected) coordinates of the cell center nearest to loc."""
         return self.raster_to_projected(self.projected_to_raster(loc))
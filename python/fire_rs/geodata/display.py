@@ -41,6 +41,7 @@ import matplotlib.pyplot as plt
 import matplotlib.transforms
 import numpy as np
 
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.colors import LightSource
 from matplotlib.ticker import FuncFormatter
 from mpl_toolkits.mplot3d import Axes3D
@@ -82,6 +83,22 @@ def get_pyplot_figure_and_axis():
     return fire_fig, fire_ax
 
 
+def get_agg_figure_and_axis():
+    """Same as get_pyplot_figure_and_axis, for a figure not tracked by pyplot.
+
+    The figure is rendered by an Agg canvas and is garbage collected as soon as it is no longer
+    referenced. Meant for batch rendering to files, where pyplot's state is useless.
+    """
+    fire_fig = matplotlib.figure.Figure()
+    FigureCanvasAgg(fire_fig)
+    fire_ax = fire_fig.add_subplot(1, 1, 1, aspect='equal', xlabel="East", ylabel="North")
+
+    ax_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
+    fire_ax.yaxis.set_major_formatter(ax_formatter)
+    fire_ax.xaxis.set_major_formatter(ax_formatter)
+    return fire_fig, fire_ax
+
+
 def plot_uav(ax, position: Tuple[float, float], orientation: float, size=1, **kwargs):
     if 'facecolor' not in kwargs:
         kwargs['facecolor'] = 'blue'
@@ -229,8 +246,22 @@ class GeoDataDisplayBase:
         figure, axis = get_pyplot_figure_and_axis()
         return cls(figure, axis, geodata, frame=frame)
 
+    @classmethod
+    def agg_figure(cls, geodata, frame=None):
+        """Display on a figure rendered with Agg and not managed by pyplot."""
+        figure, axis = get_agg_figure_and_axis()
+        return cls(figure, axis, geodata, frame=frame)
+
     def close(self):
-        plt.close(self.figure)
+        """Release the figure, with pyplot if it manages it."""
+        if getattr(self.figure.canvas, 'manager', None) is not None:
+            plt.close(self.figure)
+        else:
+            # pyplot does not know agg figures: drop their artists
+            self.figure.clf()
+        self._figure, self._axes = None, None
+        self._drawings = []
+        self._colorbars = []
 
     def clear_axis(self):
         self._axes.cla()
@@ -22,6 +22,8 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import numpy as np
+
 from fire_rs.geodata.basemap import DigitalMap, RasterTile
 
 
@@ -32,12 +34,29 @@ class ElevationMap(DigitalMap):
         """Get the height of a RGF93 position."""
         return self.get_value(position)
 
+    def get_elevations(self, positions):
+        """Get the heights of an (N, 2) array of RGF93 positions.
+
+        Positions outside the map are given a NaN height.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        elevations = np.full(len(positions), np.nan)
+        for tile, indices in self._group_by_tile(positions):
+            elevations[indices] = tile.get_point_values(positions[indices, 0],
+                                                        positions[indices, 1],
+                                                        bands=('elevation',))['elevation']
+        return elevations
+
 
 class ElevationTile(RasterTile):
 
-    def __init__(self, filename, nodata_fill=None):
-        """Initialise ElevationTile."""
-        super().__init__(filename, [('elevation', 'float64')], nodata_fill)
+    def __init__(self, filename, nodata_fill=None, float_storage=None):
+        """Initialise ElevationTile.
+
+        :param float_storage: Type used to store elevations, see RasterTile.
+        """
+        super().__init__(filename, [('elevation', 'float64')], nodata_fill, float_storage)
+        self._z = None
 
     def get_elevation(self, location):
         """Get height of projected location."""
@@ -45,8 +64,14 @@ class ElevationTile(RasterTile):
 
     @property
     def z(self):
-        """Return a 2D array of elevations."""
-        return self.data.view('float64')
+        """Return a 2D array of elevations, as float64.
+
+        Elevations stored with a smaller float type (see float_storage) are converted once, on
+        first access, and the float64 copy is kept with the tile.
+        """
+        if self._z is None:
+            self._z = self.data['elevation'].astype(self._dtype['elevation'], copy=False)
+        return self._z
 
     def __getitem__(self, key):
         """Get height of projected location."""
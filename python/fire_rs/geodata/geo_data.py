@@ -23,7 +23,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from collections import namedtuple
-from functools import reduce
+from functools import lru_cache, reduce
 
 import typing as ty
 import gdal
@@ -53,6 +53,19 @@ EPSG_ETRS89 = 4258  # European Terrestrial Reference System (Europe)
 EPSG_WGS84_UTM29N = 32629  # Lambert Azimuthal Equal-Area projection (Europe)
 EPSG_WGS84 = 4326  # European Terrestrial Reference System (Europe)
 
+# number of raster rows written to GeoTiff files at once
+_WRITE_BLOCK_ROWS = 256
+
+
+@lru_cache(maxsize=8)
+def _get_projection(epsg: int) -> osr.SpatialReference:
+    """Get the spatial reference of an EPSG code.
+
+    The object is shared by every GeoData using this code and must not be modified."""
+    proj = osr.SpatialReference()
+    proj.ImportFromEPSG(epsg)
+    return proj
+
 
 class GeoData:
     """Container for geo-referenced raster data stored in a structured numpy array."""
@@ -63,19 +76,20 @@ class GeoData:
 
         projection can be an EPSG code (int), WKT (str) or osr.SpatialReference object"""
         assert cell_width > 0 and cell_height > 0, 'Origin must be on left-bottom'
-        self.data = array  # type: 'np.array'
         self.x_offset = x_offset
         self.y_offset = y_offset
         self.cell_width = cell_width
         self.cell_height = cell_height
+        self.data = array  # type: 'np.array'
         if isinstance(projection, int):
             self._projection_epsg = projection
-            proj = osr.SpatialReference()
-            proj.ImportFromEPSG(projection)  # default is EPSG:2154, the RGF93/Lambert-93 projection
-            self._projection = proj
+            # default is EPSG:2154, the RGF93/Lambert-93 projection
+            self._projection = _get_projection(projection)
         elif isinstance(projection, osr.SpatialReference):
             self._projection = projection
-            self._projection.AutoIdentifyEPSG()
+            if self._projection.GetAuthorityCode(None) is None:
+                # leave already identified projections (e.g. shared ones) untouched
+                self._projection.AutoIdentifyEPSG()
             self._projection_epsg = int(self._projection.GetAuthorityCode(None))
         else:  # str
             proj = osr.SpatialReference()
@@ -120,15 +134,40 @@ class GeoData:
         return cls(np.full_like(other.data, fill_value), other.x_offset, other.y_offset,
                    other.cell_width, other.cell_height, projection=other.projection)
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, array):
+        self._data = array
+        # (x_min, x_max, y_min, y_max) limits of the positions contained in the GeoData
+        self._bounds = (self.x_offset - self.cell_width / 2,
+                        self.x_offset + (array.shape[0] + .5) * self.cell_width,
+                        self.y_offset - self.cell_height / 2,
+                        self.y_offset + (array.shape[1] + .5) * self.cell_height)
+
+    def __setstate__(self, state):
+        # GeoData pickled before the bounds were cached store their array as 'data'
+        if 'data' in state:
+            state = dict(state)
+            array = state.pop('data')
+            self.__dict__.update(state)
+            self.data = array
+        else:
+            self.__dict__.update(state)
+
     def __contains__(self, coordinates):
         (x, y) = coordinates
-        x_lim_low = self.x_offset - self.cell_width / 2
-        x_lim_up = self.x_offset + (self.data.shape[0] + .5) * self.cell_width
-        y_lim_low = self.y_offset - self.cell_height / 2
-        y_lim_up = self.y_offset + (self.data.shape[1] + .5) * self.cell_height
-
+        x_lim_low, x_lim_up, y_lim_low, y_lim_up = self._bounds
         return x_lim_low <= x <= x_lim_up and y_lim_low <= y <= y_lim_up
 
+    def contains_many(self, xs, ys):
+        """Boolean mask of the positions (xs, ys) contained in the GeoData."""
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        x_lim_low, x_lim_up, y_lim_low, y_lim_up = self._bounds
+        return (xs >= x_lim_low) & (xs <= x_lim_up) & (ys >= y_lim_low) & (ys <= y_lim_up)
+
     def __repr__(self):
         return self.data.__repr__()
 
@@ -215,30 +254,24 @@ class GeoData:
                        self.cell_width, self.cell_height, projection=self.projection)
 
     def split(self, x_splits: int, y_splits: int) -> List['GeoData']:
-        if x_splits == 1:
-            splet = np.split(self.data, y_splits, axis=1)
-            curr_y_offset = self.y_offset
-            res = []
-            for ary in splet:
-                res.append(GeoData(ary, self.x_offset, curr_y_offset,
-                                   self.cell_width, self.cell_height,
-                                   projection=self.projection))
-                curr_y_offset += res[-1].data.shape[1] * self.cell_height
-            assert len(res) == x_splits * y_splits
-            return res
-        else:
-            splet_on_y = self.split(x_splits=1, y_splits=y_splits)
-            res = []
-            for gd in splet_on_y:
-                splet_on_x_y = np.split(gd.data, x_splits, axis=0)
-                curr_x_offset = gd.x_offset
-                for ary in splet_on_x_y:
-                    res.append(GeoData(ary, curr_x_offset, gd.y_offset,
-                                       self.cell_width, self.cell_height,
-                                       projection=self.projection))
-                    curr_x_offset += res[-1].data.shape[0] * self.cell_width
-            assert len(res) == x_splits * y_splits
-            return res
+        """Split in x_splits * y_splits GeoData, ordered by increasing y and then increasing x."""
+        slices_on_y = np.array_split(self.data, y_splits, axis=1)
+        y_offsets = GeoData._split_offsets(slices_on_y, 1, self.y_offset, self.cell_height)
+        res = []
+        for slice_on_y, y_offset in zip(slices_on_y, y_offsets):
+            slices_on_x_y = np.array_split(slice_on_y, x_splits, axis=0)
+            x_offsets = GeoData._split_offsets(slices_on_x_y, 0, self.x_offset, self.cell_width)
+            res.extend(GeoData(ary, x_offset, y_offset, self.cell_width, self.cell_height,
+                               projection=self.projection)
+                       for ary, x_offset in zip(slices_on_x_y, x_offsets))
+        assert len(res) == x_splits * y_splits
+        return res
+
+    @staticmethod
+    def _split_offsets(slices, axis, offset, cell_size):
+        """Offsets of consecutive slices of an array along one of its axis."""
+        sizes = np.fromiter((ary.shape[axis] for ary in slices), dtype=int, count=len(slices))
+        return (offset + np.concatenate(([0], np.cumsum(sizes[:-1]))) * cell_size).tolist()
 
     def clone(self, data_array=None, fill_value=None, dtype=None):
         """Returns a clone of this GeoData.
@@ -320,38 +353,49 @@ class GeoData:
             self.write_to_file(file, layer)
 
     def write_to_file(self, filename: str, layer_name: ty.Optional[str] = None,
-                      nodata: ty.Optional[float] = None):
+                      nodata: ty.Optional[float] = None,
+                      options: ty.Optional[ty.Sequence[str]] = None):
         """Writes to GeoTiff file.
 
         If a layer_name is provided, then only the corresponding layer will be written,
-        otherwise the GeoTiff file will contain all layers."""
+        otherwise the GeoTiff file will contain all layers.
+        options are GDAL creation options of the GTiff driver, such as 'COMPRESS=LZW'."""
         layers = self.data.dtype.names if layer_name is None else [layer_name]
 
+        # in "image" files, rows and columns are inverted
+        cols, rows = self.data.shape
         if self.cell_height < 0:
-            data = self.data.transpose()  # in "image" files, rows and columns are inverted
+            flip_rows = False
             cell_height = self.cell_height
             origin_y = self.y_offset - self.cell_height / 2  # + array.shape[1] * pixelHeight
         else:
             # workaround a wind ninja bug that does not work with non-negative cell height
-            # hence, we invert our matrix on the y axis (x axis after transpose)
+            # hence, we write our matrix reversed on the y axis (rows of the file)
             # to have a negative cell_height
-            data = self.data.transpose()[::-1, ...]
+            flip_rows = True
             cell_height = - self.cell_height
             origin_y = self.y_offset + self.data.shape[1] * self.cell_height - self.cell_height / 2
 
-        cols = data.shape[1]
-        rows = data.shape[0]
         origin_x = self.x_offset - self.cell_width / 2
 
         driver = gdal.GetDriverByName('GTiff')
-        out_raster = driver.Create(filename, cols, rows, len(layers), gdal.GDT_Float64)
+        out_raster = driver.Create(filename, cols, rows, len(layers), gdal.GDT_Float64,
+                                   list(options) if options is not None else [])
         out_raster.SetGeoTransform((origin_x, self.cell_width, 0, origin_y, 0, cell_height))
         # out_raster.SetMetadata({'COMPRESSION': 'LZW', 'INTERLEAVE': 'BAND'}, 'IMAGE_STRUCTURE')
         for i, layer in enumerate(layers):
             outband = out_raster.GetRasterBand(i + 1)
             if nodata is not None:
                 outband.SetNoDataValue(nodata)
-            outband.WriteArray(data[layer])
+            # write by blocks of rows, so that only one block is transposed (and flipped) at once
+            band = self.data[layer]
+            for row in range(0, rows, _WRITE_BLOCK_ROWS):
+                end = min(rows, row + _WRITE_BLOCK_ROWS)
+                if flip_rows:
+                    block = band[:, rows - end:rows - row][:, ::-1]
+                else:
+                    block = band[:, row:end]
+                outband.WriteArray(np.ascontiguousarray(block.transpose()), 0, row)
             outband.SetDescription(
                 layer)  # apparently not visible in QGIS, maybe there is a better alternative
             outband.FlushCache()
@@ -446,23 +490,17 @@ class CoordinateTransformation:
 def join_structured_arrays(arrays):
     """Efficient method to combine several structured arrays into a single one.
 
-    This is based on the implementation of
-    http://stackoverflow.com/questions/5355744/numpy-joining-structured-arrays
-    with modifications to account for n-dimensional arrays.
+    The result is allocated once with the joint dtype and filled field by field.
 
     It is equivalent (but much faster) to the pure numpy function:
          rfn.merge_arrays(arrays, flatten=False, usemask=False).reshape(arrays[0].shape)
     """
     assert len(arrays) > 0
     assert all([array.shape == arrays[0].shape for array in arrays]), "Arrays have different shapes"
-    sizes = np.array([a.itemsize for a in arrays])
-    offsets = np.r_[0, sizes.cumsum()]
-    n = arrays[0].size  # total number of cell
-    joint = np.empty((n, offsets[-1]), dtype=np.uint8)
-    # copy each array into joint at the proper offsets
-    for a, size, offset in zip(arrays, sizes, offsets):
-        # reshape as a C-contiguous array of bytes
-        tmp = np.ascontiguousarray(a).view(np.uint8).reshape(n, size)
-        joint[:, offset:offset + size] = tmp
     dtype = sum((a.dtype.descr for a in arrays), [])
-    return joint.ravel().view(dtype).reshape(arrays[0].shape)
+    joint = np.empty(arrays[0].shape, dtype=dtype)
+    # copy each field of each array into its counterpart in joint
+    for a in arrays:
+        for name in a.dtype.names:
+            joint[name] = a[name]
+    return joint
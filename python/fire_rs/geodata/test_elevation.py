@@ -22,14 +22,18 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import itertools
 import os
+import tempfile
 import unittest
 
 import gdal
 import numpy as np
 
+from fire_rs.geodata import basemap
 from fire_rs.geodata.elevation import ElevationMap, ElevationTile
 from fire_rs.geodata.environment import DEFAULT_FIRERS_DEM_DATA
+from fire_rs.geodata.geo_data import GeoData
 
 
 class OneIGNTileTest(unittest.TestCase):
@@ -58,6 +62,14 @@ class OneIGNTileTest(unittest.TestCase):
             np.testing.assert_allclose(self.tile.projected_to_raster(
                 self.tile.raster_to_projected(corner)), corner)
 
+    def test_z_type(self):
+        self.assertEqual(self.tile.z.dtype, np.float64)
+        tile = ElevationTile(self.tile.filenames[0], float_storage=np.float16)
+        self.assertEqual(tile.z.dtype, np.float64)
+        np.testing.assert_allclose(tile.z, self.tile.z, rtol=1e-3)
+        # converted once, not on every access
+        self.assertIs(tile.z, tile.z)
+
     def test_in_function(self):
         self.assertEqual(self.tile.raster_to_projected([0, 0]) in self.tile, True)
 
@@ -111,6 +123,95 @@ class IGNElevationMap(unittest.TestCase):
                 z2xy = self.elevation_map.get_value((x*elevation.cell_width + elevation.x_offset, y*elevation.cell_height + elevation.y_offset))
                 self.assertEqual(zxy, z2xy)
 
+    def test_batched_access(self):
+        positions = np.array([[474987.5, 6175012.5],
+                              [485345.0, 6208062.0],
+                              [497841.0, 6226454.0],
+                              [0., 0.]])
+        elevations = self.elevation_map.get_elevations(positions)
+        for pos, z in zip(positions[:-1], elevations[:-1]):
+            np.testing.assert_allclose(z, self.elevation_map[pos])
+        self.assertTrue(np.isnan(elevations[-1]))
+
+
+class TileIndexTest(unittest.TestCase):
+    """Tiles found by the map indexes are the ones found by a linear scan of the tiles"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _tile(self, x, y, nx, ny, cell_size=25.):
+        """Elevation tile of nx * ny cells, the center of its first cell being (x, y)"""
+        data = np.zeros((nx, ny), dtype=[('elevation', 'float64')])
+        filename = os.path.join(self.directory, '{}_{}_{}_{}.tif'.format(x, y, nx, ny))
+        GeoData(data, x, y, cell_size, cell_size).write_to_file(filename)
+        return ElevationTile(filename)
+
+    def _check_same_as_scan(self, elevation_map, tiles, positions):
+        scan_order = [t for ts in elevation_map._tiles for t in ts]
+        self.assertEqual(set(scan_order), set(tiles))
+
+        def scan(position):
+            return next((t for t in scan_order if position in t), None)
+
+        for position in positions:
+            expected = scan(position)
+            self.assertEqual(position in elevation_map, expected is not None, position)
+            found = next((t for t in elevation_map._candidate_tiles(position)
+                          if position in t), None)
+            self.assertIs(found, expected, position)
+        # batched lookups
+        by_tile = {t: set(indices) for t, indices in
+                   elevation_map._group_by_tile(np.array(positions))}
+        for i, position in enumerate(positions):
+            expected = scan(position)
+            self.assertEqual({t for t, indices in by_tile.items() if i in indices},
+                             {expected} if expected is not None else set(), position)
+
+    @staticmethod
+    def _border_positions(tiles, offsets=(-25., -12.5, -12.5 + 1e-6, -1e-6, 0., 1e-6, 12.5,
+                                          12.5 + 1e-6, 25.)):
+        """Positions around the borders of the tiles, at the given offsets from them"""
+        xs = {b + o for t in tiles for b in (t.border_x_min, t.border_x_max) for o in offsets}
+        ys = {b + o for t in tiles for b in (t.border_y_min, t.border_y_max) for o in offsets}
+        return list(itertools.product(sorted(xs), sorted(ys)))
+
+    def test_grid(self):
+        tiles = [self._tile(12.5 + i * 1000., 12.5 + j * 1000., 40, 40)
+                 for i, j in itertools.product(range(3), range(2))]
+        elevation_map = ElevationMap(tiles)
+        self.assertIsInstance(elevation_map._index, basemap._TileGrid)
+        positions = self._border_positions(tiles)
+        positions += [tuple(p) for p in np.random.RandomState(0).uniform(-100, 3100, (200, 2))]
+        self._check_same_as_scan(elevation_map, tiles, positions)
+
+    def test_kd_tree(self):
+        # tiles of different sizes, some of them overlapping
+        tiles = [self._tile(12.5, 12.5, 40, 40), self._tile(1012.5, 12.5, 20, 60),
+                 self._tile(512.5, 512.5, 40, 40), self._tile(812.5, 212.5, 10, 10),
+                 self._tile(12.5, 1012.5, 80, 20)]
+        elevation_map = ElevationMap(tiles)
+        self.assertIsInstance(elevation_map._index, basemap._TileKDTree)
+        positions = self._border_positions(tiles)
+        positions += [tuple(p) for p in np.random.RandomState(0).uniform(-100, 2100, (200, 2))]
+        self._check_same_as_scan(elevation_map, tiles, positions)
+
+    def test_add_tile(self):
+        # the index follows the tiles added after the map was used
+        tiles = [self._tile(12.5 + i * 1000., 12.5, 40, 40) for i in range(3)]
+        elevation_map = ElevationMap(tiles[:1])
+        self.assertFalse((1500., 500.) in elevation_map)
+        elevation_map.add_tile(tiles[1])
+        self.assertTrue((1500., 500.) in elevation_map)
+        self.assertIsInstance(elevation_map._index, basemap._TileGrid)
+        elevation_map.add_tile(self._tile(512.5, 512.5, 10, 10))
+        self.assertIsInstance(elevation_map._index, basemap._TileKDTree)
+        elevation_map.add_tile(tiles[2])
+        self._check_same_as_scan(elevation_map, elevation_map._tile_list,
+                                 self._border_positions(elevation_map._tile_list))
+
 
 if __name__ == '__main__':
 
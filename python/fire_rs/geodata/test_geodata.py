@@ -27,7 +27,7 @@ import unittest
 import gdal
 import numpy as np
 
-from fire_rs.geodata.geo_data import GeoData, Area
+from fire_rs.geodata.geo_data import GeoData, Area, join_structured_arrays
 
 
 class WorldTest(unittest.TestCase):
@@ -64,6 +64,33 @@ class WorldTest(unittest.TestCase):
         combined = res[0].append_right(res[1]).append_bottom(res[2].append_right(res[3]))
         np.testing.assert_allclose(self.gd.data, combined.data)
 
+    def test_contains(self):
+        self.assertTrue((0, 0) in self.gd)
+        self.assertTrue((2.5, 2.5) in self.gd)
+        self.assertFalse((-1, 0) in self.gd)
+        self.assertFalse((0, 2.6) in self.gd)
+        xs = np.array([0, 2.5, -1, 0])
+        ys = np.array([0, 2.5, 0, 2.6])
+        np.testing.assert_array_equal(self.gd.contains_many(xs, ys),
+                                      [(x, y) in self.gd for x, y in zip(xs, ys)])
+
+    def test_join_structured_arrays(self):
+        a = np.array([[1.5, 2.5], [3.5, 4.5]], dtype=[('a', 'float64')])
+        b = np.array([[1, 2], [3, 4]], dtype=[('b', 'int16'), ('c', 'uint8')])
+        joint = join_structured_arrays([a, b])
+        self.assertEqual(joint.dtype.names, ('a', 'b', 'c'))
+        self.assertEqual(joint.shape, (2, 2))
+        np.testing.assert_array_equal(joint['a'], a['a'])
+        np.testing.assert_array_equal(joint['b'], b['b'])
+        np.testing.assert_array_equal(joint['c'], b['c'])
+
+    def test_uneven_split(self):
+        gd = GeoData(np.arange(15).reshape(5, 3), 10, 20, 2, 2)
+        res = gd.split(2, 2)
+        self.assertEqual([t.data.shape for t in res], [(3, 2), (2, 2), (3, 1), (2, 1)])
+        self.assertEqual([(t.x_offset, t.y_offset) for t in res],
+                         [(10, 20), (16, 20), (10, 24), (16, 24)])
+
     def test_subset(self):
         res = self.gd.subset(Area(1, 1, 0, 1))
         self.assertEqual(res.data.shape, (1, 2))
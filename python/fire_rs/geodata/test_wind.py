@@ -22,9 +22,13 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import itertools
 import os
+import stat
+import subprocess
 import tempfile
 import unittest
+import unittest.mock
 from datetime import datetime
 
 import gdal
@@ -32,6 +36,7 @@ import numpy as np
 from pytz import timezone
 
 from fire_rs.geodata.elevation import ElevationMap, ElevationTile
+import fire_rs.geodata.wind as wind
 from fire_rs.geodata.wind import *
 from fire_rs.geodata.environment import DEFAULT_FIRERS_DEM_DATA
 
@@ -103,6 +108,212 @@ class WindMapTest(unittest.TestCase):
         self.assertEqual(len(w), 2)
 
 
+class WindNinjaBatchTest(unittest.TestCase):
+    """run_batch with a WindNinja_cli script recording its arguments"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cli_path = directory.name
+        self.calls_file = os.path.join(self.cli_path, 'calls')
+        script = os.path.join(self.cli_path, 'WindNinja_cli')
+        with open(script, 'w') as f:
+            f.write('#!/bin/sh\n'
+                    'echo "$@" >> calls\n'
+                    'case "$*" in *fail*) exit 3;; esac\n')
+        os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR)
+        self.cli = WindNinjaCLI(path=self.cli_path)
+        self.cli.add_arguments(**WindNinjaCLI.domain_average_args(3.0, 0))
+        self.cli.add_arguments(num_threads=8)
+
+    def _calls(self):
+        with open(self.calls_file) as f:
+            return [line.split() for line in f]
+
+    def test_one_run_per_file(self):
+        completed = self.cli.run_batch(['a.tif', 'with space.tif'])
+        self.assertEqual(completed.returncode, 0)
+        calls = self._calls()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0][:-1], self.cli.args_list())
+        self.assertEqual(calls[0][-1], '--elevation_file=a.tif')
+        self.assertEqual(calls[1][-2:], ['--elevation_file=with', 'space.tif'])
+
+    def test_failure(self):
+        completed = self.cli.run_batch(['fail.tif', 'b.tif'])
+        self.assertNotEqual(completed.returncode, 0)
+        # the other files are still processed
+        self.assertEqual([c[-1] for c in self._calls()],
+                         ['--elevation_file=fail.tif', '--elevation_file=b.tif'])
+
+    def test_num_threads(self):
+        self.cli.run_batch(['a.tif'], num_threads=2)
+        call = self._calls()[0]
+        self.assertEqual([a for a in call if a.startswith('--num_threads=')], ['--num_threads=2'])
+        self.assertIn('--num_threads=8', self.cli.args_list())
+
+
+class SubtileSplitTest(unittest.TestCase):
+    """Subtiles found by WindMap are the parts of the DEM tile written for WindNinja"""
+
+    def setUp(self):
+        self.tile = ElevationTile(os.path.join(DEFAULT_FIRERS_DEM_DATA,
+                                               'BDALTIV2_25M_FXX_0500_6225_MNT_LAMB93_IGN69.tif'))
+        self.elevation_map = ElevationMap([self.tile])
+        self.cli = WindNinjaCLI()
+        self.cli.add_arguments(**WindNinjaCLI.domain_average_args(3.0, 0))
+        self.cli.set_output_path(tempfile.gettempdir())
+
+    def test_split_edges(self):
+        for n_cells, n_splits in [(10, 3), (1000, 4), (1000, 7), (5, 5)]:
+            edges = wind._split_edges(100., -25., n_cells, n_splits)
+            self.assertEqual(len(edges), n_splits + 1)
+            self.assertEqual(edges[0], 100.)
+            self.assertEqual(edges[-1], 100. + n_cells * 25.)
+            sizes = [len(p) for p in np.array_split(np.arange(n_cells), n_splits)]
+            np.testing.assert_allclose(np.diff(edges), np.array(sizes) * 25.)
+
+    def test_same_as_dem_split(self):
+        dx, dy = abs(self.tile.x_delta), abs(self.tile.y_delta)
+        nx, ny = self.tile.raster_size
+        for split in (3, 4, 7):  # 1000 cells are split unevenly in 3 or 7 parts
+            wmap = WindMap([], self.elevation_map, self.cli, dem_tile_split=split)
+            grid = wmap._split_dem_tile(self.tile)
+            x_parts = [len(p) for p in np.array_split(np.arange(nx), split)]
+            y_parts = [len(p) for p in np.array_split(np.arange(ny), split)]
+            x_first = np.cumsum([0] + x_parts[:-1])
+            y_first = np.cumsum([0] + y_parts[:-1])
+            # cells on both sides of the subtile edges, and the first and last ones
+            x_cells = sorted({0, nx - 1} | set(x_first) | set(x_first[1:] - 1))
+            y_cells = sorted({0, ny - 1} | set(y_first) | set(y_first[1:] - 1))
+            for cx, cy in itertools.product(x_cells, y_cells):
+                position = (self.tile.x_min + cx * dx, self.tile.y_min + cy * dy)
+                base_tile, xi, yi = wmap._subtile_index(position)
+                self.assertIs(base_tile, self.tile)
+                self.assertEqual((xi, yi), (np.searchsorted(x_first, cx, side='right') - 1,
+                                            np.searchsorted(y_first, cy, side='right') - 1))
+                self.assertIn(position, grid[xi][yi])
+            # positions exactly on the edges are in the subtile found for them
+            for x, y in itertools.product(
+                    wind._split_edges(self.tile.border_x_min, dx, nx, split)[1:-1],
+                    wind._split_edges(self.tile.border_y_min, dy, ny, split)[1:-1]):
+                _, xi, yi = wmap._subtile_index((x, y))
+                self.assertIn((x, y), grid[xi][yi])
+
+
+class WindMapLoadTilesTest(unittest.TestCase):
+    """Loading of the subtiles of a DEM tile, with WindNinja mocked"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_path = directory.name
+
+        self.tile = ElevationTile(os.path.join(DEFAULT_FIRERS_DEM_DATA,
+                                               'BDALTIV2_25M_FXX_0500_6225_MNT_LAMB93_IGN69.tif'))
+        self.elevation_map = ElevationMap([self.tile])
+
+        self.cli = WindNinjaCLI()
+        self.cli.add_arguments(**WindNinjaCLI.domain_average_args(3.0, 0))
+        self.cli.add_arguments(num_threads=16)
+        self.cli.set_output_path(self.output_path)
+        patcher = unittest.mock.patch.object(self.cli, 'run_batch',
+                                             return_value=subprocess.CompletedProcess([], 0))
+        self.run_batch = patcher.start()
+        self.addCleanup(patcher.stop)
+        # WindNinja outputs are not read
+        patcher = unittest.mock.patch('fire_rs.geodata.wind.WindTile')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = unittest.mock.patch.object(WindMap, 'add_tile')
+        self.add_tile = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.wmap = WindMap([], self.elevation_map, self.cli, dem_tile_split=4)
+
+    def _subtile_centers(self, n=4):
+        """A position at the center of each of the n x n subtiles of the DEM tile"""
+        xs = np.linspace(self.tile.x_min, self.tile.x_max, 2 * n + 1)[1::2]
+        ys = np.linspace(self.tile.y_min, self.tile.y_max, 2 * n + 1)[1::2]
+        return [(x, y) for x in xs for y in ys]
+
+    def _run_files(self):
+        return [f for c in self.run_batch.call_args_list for f in c[0][0]]
+
+    def test_each_subtile_run_once(self):
+        positions = self._subtile_centers()
+        self.wmap._load_tiles(positions + positions[::-1])
+        run_files = self._run_files()
+        self.assertEqual(len(run_files), 16)
+        self.assertEqual(len(set(run_files)), 16)
+        self.assertTrue(all(os.path.exists(f) for f in run_files))
+        self.assertEqual(self.add_tile.call_count, 16)
+        self.assertEqual(len(self.wmap._loaded_subtiles), 16)
+
+        # everything is loaded already
+        self.wmap._load_tiles(positions)
+        self.assertEqual(len(self._run_files()), 16)
+        self.assertEqual(self.add_tile.call_count, 16)
+
+    def test_threads_shared_by_runs(self):
+        self.wmap._load_tiles(self._subtile_centers())
+        n_workers = min(wind._MAX_WINDNINJA_WORKERS, 16)
+        for c in self.run_batch.call_args_list:
+            self.assertEqual(c[0][1], 16 // n_workers)
+
+        # a single run gets all the threads
+        self.run_batch.reset_mock()
+        self.wmap = WindMap([], self.elevation_map, self.cli, dem_tile_split=4)
+        self.wmap._load_tiles(self._subtile_centers()[:1])
+        self.run_batch.assert_called_once_with(unittest.mock.ANY, 16)
+
+    def test_existing_wind_files_not_run(self):
+        positions = self._subtile_centers()
+        base_tile, xi, yi = self.wmap._subtile_index(positions[0])
+        _, windfile_paths = self.wmap._subtile_paths(base_tile, xi, yi)
+        for path in windfile_paths:
+            open(path, 'w').close()
+        self.wmap._load_tiles(positions)
+        self.assertEqual(len(self._run_files()), 15)
+        self.assertEqual(self.add_tile.call_count, 16)
+
+    def test_failure(self):
+        self.run_batch.return_value = subprocess.CompletedProcess([], 1)
+        with self.assertRaises(RuntimeError):
+            self.wmap._load_tiles(self._subtile_centers())
+        self.add_tile.assert_not_called()
+        self.assertEqual(len(self.wmap._loaded_subtiles), 0)
+
+    @unittest.mock.patch('fire_rs.geodata.basemap.DigitalMap.get_values')
+    def test_get_values_loaded_region(self, _):
+        # region within the subtile (0, 0), then overlapping the subtiles (0..1, 0..1)
+        centers = self._subtile_centers()
+        (x0, y0), (x1, y1) = centers[0], centers[5]
+        small = ((x0 - 100, x0 + 100), (y0 - 100, y0 + 100))
+        large = ((x0, x1), (y0, y1))
+        self.wmap.get_values(small)
+        self.assertEqual(len(self._run_files()), 1)
+
+        with unittest.mock.patch.object(self.wmap, '_load_tiles',
+                                        wraps=self.wmap._load_tiles) as load_tiles:
+            # already loaded: WindNinja is not even looked for
+            self.wmap.get_values(small)
+            load_tiles.assert_not_called()
+            self.assertEqual(len(self._run_files()), 1)
+
+            # partly loaded: only the missing subtiles are computed
+            self.wmap.get_values(large)
+            load_tiles.assert_called_once()
+            run_files = self._run_files()
+            self.assertEqual(len(run_files), 4)
+            self.assertEqual(len(set(run_files)), 4)
+
+            self.wmap.get_values(large)
+            load_tiles.assert_called_once()
+        self.assertEqual(len(self._run_files()), 4)
+        self.assertEqual(self.add_tile.call_count, 4)
+
+
 class WindAngleTransformTest(unittest.TestCase):
 
     def test_geo_to_trigo(self):
@@ -22,11 +22,17 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import bisect
+import functools
 import logging
 import os
+import queue
 import subprocess
 import itertools
+import shlex
 import shutil
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
 
@@ -39,6 +45,18 @@ logger = logging.getLogger(__name__)
 # smaller DEM tiles to feed windninja
 _DEFAULT_DEM_TILE_SPLIT = 4
 
+# Number of threads of a WindNinja run: the cores available to this process
+_DEFAULT_NUM_THREADS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 2
+
+# GDAL creation options of the DEM subtiles given to WindNinja.
+# Elevation is smooth, so floating point prediction makes LZW compression efficient.
+_DEM_TILE_CREATION_OPTIONS = ['COMPRESS=LZW', 'PREDICTOR=3',
+                              'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+
+# Maximum number of WindNinja processes run concurrently when loading several subtiles.
+# Each solver is memory hungry, so keep this bounded even on machines with many cores.
+_MAX_WINDNINJA_WORKERS = min(8, os.cpu_count() or 1)
+
 WINDNINJA_CLI_PATH = os.environ['WINDNINJA_CLI_PATH'] \
     if 'WINDNINJA_CLI_PATH' in os.environ else None
 if not WINDNINJA_CLI_PATH:
@@ -60,6 +78,12 @@ def geo_angle_to_trigo_angle(angles):
     return angles % (np.pi * 2)
 
 
+def _split_edges(border_min, cell_size, n_cells, n_splits):
+    """Boundaries of the parts of an axis of n_cells cells split as GeoData.split does."""
+    sizes = [len(part) for part in np.array_split(np.arange(n_cells), n_splits)]
+    return [border_min + offset * abs(cell_size) for offset in itertools.accumulate([0] + sizes)]
+
+
 def trigo_angle_to_geo_angle(angles):
     """Converts a trigonometric angle to a geographic one (as used by windninja)"""
     angles = angles * 360. / (2 * np.pi)
@@ -79,6 +103,12 @@ class WindMap(DigitalMap):
         """
         super().__init__(tiles)
         self.elevation_map = elevation_map
+        # the same corners and subtile samples are looked up repeatedly in the DEM tiles
+        self._tile_of = functools.lru_cache(maxsize=256)(elevation_map.tile_of_location)
+        # DEM tile -> (x edges, y edges) of its subparts
+        self._subtile_edges = weakref.WeakKeyDictionary()
+        # subtiles of the DEM tiles being loaded. Only a few are kept as they hold a whole DEM tile
+        self._dem_split_grid = functools.lru_cache(maxsize=2)(self._split_dem_tile)
 
         self.scenario = windninja.args
         self.windninja_cli = windninja
@@ -101,60 +131,198 @@ class WindMap(DigitalMap):
                                      self.scenario['units_ascii_out_resolution']]))
 
         self.scenario_str = '_'.join(sce_list)  # part of WindNinja output file(s)
-
-    def _load_tile(self, position):
-        """Load the tile corresponding to this possition.
-
-        It runs windninja on a subset of the DEM if necessary.
+        self._windfile_suffixes = ('_' + self.scenario_str + '_vel.asc',
+                                   '_' + self.scenario_str + '_ang.asc')
+        self._output_path = self.scenario.get('output_path')
+        # DEM tile -> name of its file, without extension
+        self._tile_base_names = weakref.WeakKeyDictionary()
+
+        # (DEM tile file, xi, yi) of the subtiles already part of this map
+        self._loaded_subtiles = set()
+
+        # paths of the DEM and wind files known to be in the output folder, to avoid
+        # checking the filesystem each time a tile is loaded
+        self._artifact_index = set()
+        if self._output_path is not None and os.path.isdir(self._output_path):
+            self._artifact_index.update(
+                os.path.join(self._output_path, f) for f in os.listdir(self._output_path))
+
+    def _has_artifact(self, path):
+        """Whether a DEM or wind file exists, checking the filesystem only for unknown files."""
+        if path in self._artifact_index:
+            return True
+        if os.path.exists(path):
+            self._artifact_index.add(path)
+            return True
+        return False
+
+    def _subtile_index(self, position):
+        """Find the part of the DEM containing a position.
+
+        :return: (base_tile, xi, yi) where base_tile is the elevation tile of the position
+            and (xi, yi) the subpart of it holding the position.
         """
         (x, y) = position
-        base_tile = self.elevation_map.tile_of_location(position)
+        base_tile = self._tile_of((x, y))
         assert (x, y) in base_tile
 
-        # find in which subpart of the elevation tile this location is
-        xi = int((x - base_tile.border_x_min) / (
-                base_tile.border_x_max - base_tile.border_x_min) * self.dem_tile_split)
-        yi = int((y - base_tile.border_y_min) / (
-                base_tile.border_y_max - base_tile.border_y_min) * self.dem_tile_split)
+        # find in which subpart of the elevation tile this location is, using the same
+        # boundaries as the split of the DEM tile
+        edges = self._subtile_edges.get(base_tile)
+        if edges is None:
+            edges = (_split_edges(base_tile.border_x_min, base_tile.x_delta,
+                                  base_tile.raster_size[0], self.dem_tile_split),
+                     _split_edges(base_tile.border_y_min, base_tile.y_delta,
+                                  base_tile.raster_size[1], self.dem_tile_split))
+            self._subtile_edges[base_tile] = edges
+        last = self.dem_tile_split - 1
+        xi = min(max(bisect.bisect_right(edges[0], x) - 1, 0), last)
+        yi = min(max(bisect.bisect_right(edges[1], y) - 1, 0), last)
+        return base_tile, xi, yi
+
+    def _subtile_paths(self, base_tile, xi, yi):
+        """Files associated to a subpart of a DEM tile.
+
+        :return: (dem_file_name, windfile_paths)
+        """
+        base_name = self._tile_base_names.get(base_tile)
+        if base_name is None:
+            base_name = os.path.splitext(os.path.basename(base_tile.filenames[0]))[0]
+            self._tile_base_names[base_tile] = base_name
 
         # build tile names of this wind scenario and subpart of the DEM tile
-        tile_name = os.path.splitext(os.path.split(base_tile.filenames[0])[1])[0] + \
-                    '[{0}%{2},{1}%{2}]'.format(xi, yi, self.dem_tile_split)
-        dem_file_name = os.path.join(self.scenario['output_path'], tile_name + '.tif')
-
-        # save smaller DEM tile if it does not exists yet
-        if not os.path.exists(dem_file_name):
-            dem = base_tile.as_geo_data().split(self.dem_tile_split, 1)[xi].split(
-                1, self.dem_tile_split)[yi]
+        tile_name = '{0}[{1}%{3},{2}%{3}]'.format(base_name, xi, yi, self.dem_tile_split)
+        dem_file_name = os.path.join(self._output_path, tile_name + '.tif')
+
+        windfile_paths = [os.path.join(self._output_path, tile_name + suffix)
+                          for suffix in self._windfile_suffixes]
+        return dem_file_name, windfile_paths
+
+    def _split_dem_tile(self, base_tile):
+        """Split a DEM tile in its subparts, as a grid indexed by [xi][yi]."""
+        return [x_part.split(1, self.dem_tile_split)
+                for x_part in base_tile.as_geo_data().split(self.dem_tile_split, 1)]
+
+    def _save_subtile_dem(self, position, base_tile, xi, yi, dem_file_name):
+        """Save the smaller DEM tile containing this position if it does not exists yet."""
+        if not self._has_artifact(dem_file_name):
+            dem = self._dem_split_grid(base_tile)[xi][yi]
             assert position in dem
-            dem.write_to_file(dem_file_name)
-
-        windfile_paths = [os.path.join(self.scenario['output_path'],
-                                       '_'.join([tile_name,
-                                                 self.scenario_str,
-                                                 'vel.asc'])),
-                          os.path.join(self.scenario['output_path'],
-                                       '_'.join([tile_name,
-                                                 self.scenario_str,
-                                                 'ang.asc']))]
-
-        if not (os.path.exists(windfile_paths[0]) and os.path.exists(windfile_paths[1])):
+            dem.write_to_file(dem_file_name, options=_DEM_TILE_CREATION_OPTIONS)
+            self._artifact_index.add(dem_file_name)
+
+    def _load_tile(self, position):
+        """Load the tile corresponding to this possition.
+
+        It runs windninja on a subset of the DEM if necessary.
+        """
+        base_tile, xi, yi = self._subtile_index(position)
+        dem_file_name, windfile_paths = self._subtile_paths(base_tile, xi, yi)
+        self._save_subtile_dem(position, base_tile, xi, yi, dem_file_name)
+
+        if not (self._has_artifact(windfile_paths[0]) and self._has_artifact(windfile_paths[1])):
             self._run_windninja(dem_file_name)
+            self._artifact_index.update(windfile_paths)
 
         # FIXME: Crop asc files to dem col and row count.
         # WindNinja results are bigger than the input
 
+        self._loaded_subtiles.add((base_tile.filenames[0], xi, yi))
         return WindTile(windfile_paths)
 
+    def _load_tiles(self, positions):
+        """Load the tiles of several positions, running WindNinja concurrently where needed.
+
+        Positions falling in the same subtile are only loaded once. WindNinja starts on a
+        subtile as soon as its DEM is written, while the next DEM subtiles are being prepared.
+        New tiles are added to the map once all WindNinja runs have succeeded.
+        The threads of a WindNinja run (its num_threads argument) are shared by the concurrent
+        runs.
+        """
+        # (position, subtile, dem_file_name, windfile_paths, needs WindNinja) of the new subtiles
+        new_subtiles = []
+        new_keys = set()
+        for position in positions:
+            base_tile, xi, yi = self._subtile_index(position)
+            key = (base_tile.filenames[0], xi, yi)
+            if key in self._loaded_subtiles or key in new_keys:
+                continue
+            if position in self:
+                # tile given at construction, no need to check this subtile again
+                self._loaded_subtiles.add(key)
+                continue
+            new_keys.add(key)
+            dem_file_name, windfile_paths = self._subtile_paths(base_tile, xi, yi)
+            missing = not (self._has_artifact(windfile_paths[0]) and
+                           self._has_artifact(windfile_paths[1]))
+            new_subtiles.append((position, (base_tile, xi, yi), dem_file_name, windfile_paths,
+                                 missing))
+
+        num_threads = int(self.windninja_cli.args.get('num_threads', _DEFAULT_NUM_THREADS))
+        n_workers = max(1, min(_MAX_WINDNINJA_WORKERS, num_threads,
+                               sum(missing for *_, missing in new_subtiles)))
+        threads_per_run = max(1, num_threads // n_workers)
+
+        dem_queue = queue.Queue()
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            consumers = []
+            try:
+                for position, subtile, dem_file_name, _, missing in new_subtiles:
+                    self._save_subtile_dem(position, *subtile, dem_file_name)
+                    if missing:
+                        if len(consumers) < n_workers:
+                            consumers.append(executor.submit(
+                                self._run_windninja_queue, dem_queue, threads_per_run))
+                        dem_queue.put(dem_file_name)
+            finally:
+                # let the consumers stop once the queue is empty, even on failure
+                for _ in consumers:
+                    dem_queue.put(None)
+            for future in as_completed(consumers):
+                future.result()  # propagate WindNinja failures
+
+        for *_, windfile_paths, _ in new_subtiles:
+            self._artifact_index.update(windfile_paths)
+            self.add_tile(WindTile(windfile_paths))
+        self._loaded_subtiles.update(new_keys)
+
+    def _run_windninja_queue(self, dem_queue: 'queue.Queue', num_threads=None):
+        """Run WindNinja on the DEM files of a queue until None is received.
+
+        The DEM files waiting in the queue are run together, in a single batch.
+        :param num_threads: threads of each WindNinja run instead of the one in the arguments.
+        """
+        done = False
+        while not done:
+            batch = [dem_queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(dem_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                self._run_windninja_batch(batch, num_threads)
+
     def _run_windninja(self, elevation_file: str):
-        self.windninja_cli.set_elevation_file(elevation_file)
-        completed = self.windninja_cli.run()
+        completed = self.windninja_cli.run(elevation_file)
         if completed.returncode != 0:
             raise RuntimeError("Error during execution! WindNinja returned {}.".format(
                 completed.returncode))
 
-    def get_value(self, position):
-        """Get the value corresponding to a position."""
+    def _run_windninja_batch(self, elevation_files, num_threads=None):
+        completed = self.windninja_cli.run_batch(elevation_files, num_threads)
+        if completed.returncode != 0:
+            raise RuntimeError("Error during execution! WindNinja returned {} on {}.".format(
+                completed.returncode, elevation_files))
+
+    def get_value(self, x, y=None):
+        """Get the value corresponding to a position, given as (x, y) or as two scalars."""
+        if y is None:
+            x, y = x[0], x[1]
+        position = (x, y)
         if position not in self.elevation_map:
             raise KeyError("Location out of elevation map bounds")
 
@@ -163,30 +331,38 @@ class WindMap(DigitalMap):
             tile = self._load_tile(position)
             self.add_tile(tile)
             return tile[position]
-        return super().get_value(position)
+        return super().get_value(x, y)
 
     def get_values(self, positions_intervals):
         ((x_min, x_max), (y_min, y_max)) = positions_intervals
         assert all(
             [p in self.elevation_map for p in itertools.product((x_min, x_max), (y_min, y_max))]), \
             'The requested rectangle is not contained in the known DEM tiles'
-        sample_tile = self.elevation_map.tile_of_location((x_min, y_min))
+        min_tile = self._tile_of((x_min, y_min))
+        max_tile = self._tile_of((x_max, y_max))
+
+        if min_tile is max_tile:
+            # skip sampling if all the subtiles intersecting the rectangle are already loaded
+            _, xi_min, yi_min = self._subtile_index((x_min, y_min))
+            _, xi_max, yi_max = self._subtile_index((x_max, y_max))
+            tile_file = min_tile.filenames[0]
+            if all((tile_file, xi, yi) in self._loaded_subtiles
+                   for xi in range(xi_min, xi_max + 1) for yi in range(yi_min, yi_max + 1)):
+                return super().get_values(positions_intervals)
+
         subtile_width = \
-            (sample_tile.x_max - sample_tile.x_min + sample_tile.x_delta) / self.dem_tile_split
+            (min_tile.x_max - min_tile.x_min + min_tile.x_delta) / self.dem_tile_split
 
         # round x/y to cell centers
-        (x_min, y_min) = self.elevation_map.tile_of_location(
-            (x_min, y_min)).nearest_projected_point((x_min, y_min))
-        (x_max, y_max) = self.elevation_map.tile_of_location(
-            (x_max, y_max)).nearest_projected_point((x_max, y_max))
+        (x_min, y_min) = min_tile.nearest_projected_point((x_min, y_min))
+        (x_max, y_max) = max_tile.nearest_projected_point((x_max, y_max))
 
         # sample xs and ys so we have one in each subcell
         xs = list(range(int(x_min), int(x_max), int(subtile_width))) + [int(x_max)]
         ys = list(range(int(y_min), int(y_max), int(subtile_width))) + [int(y_max)]
 
         # force loading all subtiles
-        for pos in itertools.product(xs, ys):
-            self.get_value(pos)
+        self._load_tiles(list(itertools.product(xs, ys)))
 
         # now that all tiles are loaded, rely on the generic method
         return super().get_values(positions_intervals)
@@ -199,7 +375,10 @@ class WindMap(DigitalMap):
 class WindTile(RasterTile):
 
     def __init__(self, windfile_paths):
-        super().__init__(windfile_paths, [('wind_velocity', 'float64'), ('wind_angle', 'float64')])
+        # angles are converted after loading: keep them in float64, as a float32 angle may round
+        # out of [0, 2*pi)
+        super().__init__(windfile_paths, [('wind_velocity', 'float64'), ('wind_angle', 'float64')],
+                         float_storage=np.float64)
 
     def _load_data(self):
         super()._load_data()
@@ -215,8 +394,8 @@ class WindNinjaCLI():
     def __init__(self, path=WINDNINJA_CLI_PATH, ascii_out_resolution=25, cli_arguments=None):
         self.windninja_path = path
         self.args = {}  # dict(arg, value)
-        num_threads = len(os.sched_getaffinity(0)) if "sched_getaffinity" in dir(os) else 2
-        self.add_arguments(num_threads=num_threads,
+        self._args_cache = None  # serialized arguments, except elevation_file
+        self.add_arguments(num_threads=_DEFAULT_NUM_THREADS,
                            output_speed_units='kph',
                            ascii_out_resolution=int(ascii_out_resolution),
                            units_ascii_out_resolution='m',
@@ -233,8 +412,21 @@ class WindNinjaCLI():
         return " ".join(["=".join(("".join(
             ("--", key)), value)) for key, value in self.args.items()])
 
-    def args_list(self):
-        return ["=".join(("".join(("--", key)), value)) for key, value in self.args.items()]
+    def _base_args_list(self):
+        """Command line arguments except the elevation file, only serialized after a change."""
+        if self._args_cache is None:
+            self._args_cache = tuple("=".join(("".join(("--", key)), value))
+                                     for key, value in self.args.items()
+                                     if key != 'elevation_file')
+        return self._args_cache
+
+    def args_list(self, elevation_file=None):
+        """Command line arguments, optionally overriding the elevation file."""
+        if elevation_file is None:
+            elevation_file = self.args.get('elevation_file')
+        if elevation_file is None:
+            return list(self._base_args_list())
+        return [*self._base_args_list(), "--elevation_file=" + elevation_file]
 
     @property
     def elevation_file(self):
@@ -258,6 +450,7 @@ class WindNinjaCLI():
         It must exist already. If not, WindNinja won't create it and will
         write to the default location"""
         self.args['output_path'] = output_folder
+        self._args_cache = None
 
     def set_output_path(self, output_folder):
         """Set output path.
@@ -269,22 +462,27 @@ class WindNinjaCLI():
     def add_arguments(self, **kwargs):
         for key, value in kwargs.items():
             self.args[str(key)] = str(value)
+        self._args_cache = None
 
-    def run(self):
+    def run(self, elevation_file=None):
         """Run WindNinja.
 
+        :param elevation_file: DEM to use instead of the one in the arguments.
         :return: subprocess.CompletedProcess instance.
         """
-        return self.run_blocking()
+        return self.run_blocking(elevation_file)
 
-    def run_blocking(self):
+    def run_blocking(self, elevation_file=None):
         """Run WindNinja.
 
         This function blocks the execution until the process is finished.
+        The arguments of this instance are left untouched, so several runs on
+        different elevation files can safely happen in parallel.
 
+        :param elevation_file: DEM to use instead of the one in the arguments.
         :return: subprocess.CompletedProcess instance.
         """
-        arguments = self.args_list()
+        arguments = self.args_list(elevation_file)
         cli = os.path.join(self.windninja_path, "WindNinja_cli")
         # Working directory must be the one in which WindNinja_cli is located
         # because it searchs locally the date_time_zonespec.csv.
@@ -293,6 +491,32 @@ class WindNinjaCLI():
         completed = subprocess.run((cli, *arguments), cwd=self.windninja_path)
         return completed
 
+    def run_batch(self, elevation_files, num_threads=None):
+        """Run WindNinja on several elevation files from a single process.
+
+        A small shell loop invokes WindNinja_cli on each file in turn, so that
+        only one process is spawned from Python for the whole batch. A failure
+        on one file does not prevent the others from being processed.
+
+        :param elevation_files: Sequence of DEM files.
+        :param num_threads: Threads of each run instead of the num_threads argument.
+        :return: subprocess.CompletedProcess instance. Its return code is
+            non-zero if any of the runs failed.
+        """
+        cli = os.path.join(self.windninja_path, "WindNinja_cli")
+        arguments = self._base_args_list()
+        if num_threads is not None:
+            arguments = [a for a in arguments if not a.startswith("--num_threads=")]
+            arguments.append("--num_threads={}".format(int(num_threads)))
+        command = " ".join(shlex.quote(a) for a in (cli, *arguments))
+        script = 'status=0; for dem in "$@"; do {} --elevation_file="$dem" || status=1; done; ' \
+                 'exit $status'.format(command)
+        logger.info("%s on %s", command, " ".join(elevation_files))
+        # Same working directory as in run_blocking
+        completed = subprocess.run(("sh", "-c", script, "sh", *elevation_files),
+                                   cwd=self.windninja_path)
+        return completed
+
     @staticmethod
     def domain_average_args(input_speed, input_direction, vegetation='trees'):
         """Generate a set of arguments for WindNinja for a domain average input.
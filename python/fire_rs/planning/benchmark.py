@@ -33,7 +33,6 @@ import json
 import logging
 import numpy as np
 import os
-import random
 import typing as ty
 import pytz
 
@@ -67,6 +66,9 @@ DISCRETE_ELEVATION_INTERVAL = 100
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
+# Random generator of the scenario factories. Seeded by the create command for reproducibility
+_rng = np.random.RandomState()
+
 
 class FlightConf:
 
@@ -165,6 +167,36 @@ class Scenario:
                         ", traj_conf=", repr(self.flights), ")"])
 
 
+def _ignition_time_range(ignition: np.ndarray) -> ty.Tuple[float, float]:
+    """First and last ignition times of an ignition array, unburned cells (_DBL_MAX) excluded."""
+    # Only burned cells are gathered, there is no need for a NaN-filled copy of the whole array
+    burned = ignition[ignition != _DBL_MAX]
+    if burned.size == 0:
+        return np.nan, np.nan
+    return burned.min(), burned.max()
+
+
+def _uniform(low: float, high: float) -> float:
+    return float(_rng.uniform(low, high))
+
+
+def _randint(low: int, high: int) -> int:
+    """Random integer in [low, high], both included as with random.randint."""
+    return int(_rng.randint(low, high + 1))
+
+
+def _choice(seq: ty.Sequence):
+    return seq[_rng.randint(len(seq))]
+
+
+def _random_ignitions(n: int, x_range: ty.Tuple[float, float], y_range: ty.Tuple[float, float],
+                      time_range: ty.Tuple[float, float]) -> ty.List[TimedPoint]:
+    """Draw n ignitions uniformly in the given ranges of coordinates and time."""
+    points = _rng.uniform(low=(x_range[0], y_range[0], time_range[0]),
+                          high=(x_range[1], y_range[1], time_range[1]), size=(n, 3))
+    return [TimedPoint(*p) for p in points.tolist()]
+
+
 def run_benchmark(scenario: Scenario, save_directory: str, instance_name: str,
                   output_options_plot: ty.Mapping[str, ty.Any],
                   output_options_planning: ty.Mapping[str, ty.Any],
@@ -232,15 +264,10 @@ def run_benchmark(scenario: Scenario, save_directory: str, instance_name: str,
     # 10-minute mark (minus 1). This makes color bar ranges and fire front contour plots nicer
     ignitions['ignition'][ignitions['ignition'] > \
                           int(scenario.time_window_end / 60. + 5) * 60. - 60] = _DBL_MAX
-    # Representation of unburned cells using max double is not suitable for display,
-    # so those values must be converted to NaN
-    ignitions_nan = ignitions['ignition'].copy()
-    ignitions_nan[ignitions_nan == _DBL_MAX] = np.nan
-    first_ignition = np.nanmin(ignitions_nan)
-    last_ignition = np.nanmax(ignitions_nan)
+    first_ignition, last_ignition = _ignition_time_range(ignitions['ignition'])
 
     # Create the geodatadisplay object & extensions that are going to be used
-    geodatadisplay = GeoDataDisplay.pyplot_figure(env.raster.combine(ignitions), frame=(0, 0))
+    geodatadisplay = GeoDataDisplay.agg_figure(env.raster.combine(ignitions), frame=(0, 0))
     geodatadisplay.add_extension(TrajectoryDisplayExtension, (None,), {})
 
     plot_plan_with_background(final_plan, geodatadisplay, (first_ignition, last_ignition),
@@ -291,19 +318,19 @@ def run_benchmark(scenario: Scenario, save_directory: str, instance_name: str,
         parsed["date"] = datetime.datetime.now().isoformat()
         metadata_file.write(json.dumps(parsed, indent=4))
 
-    matplotlib.pyplot.close(geodatadisplay.axes.get_figure())
+    geodatadisplay.close()
 
     # If intermediate plans are available, save them
-    for i, plan in enumerate(search_result.intermediate_plans):
-        geodatadisplay = GeoDataDisplay.pyplot_figure(env.raster.combine(ignitions))
+    intermediate_plans = search_result.intermediate_plans
+    if len(intermediate_plans) > 0:
+        i_plan_dir = os.path.join(save_directory, instance_name)
+        os.makedirs(i_plan_dir, exist_ok=True)
+    for i, plan in enumerate(intermediate_plans):
+        geodatadisplay = GeoDataDisplay.agg_figure(env.raster.combine(ignitions))
         geodatadisplay.add_extension(TrajectoryDisplayExtension, (None,), {})
         plot_plan_with_background(plan, geodatadisplay, (first_ignition, last_ignition),
                                   output_options_plot)
 
-        i_plan_dir = os.path.join(save_directory, instance_name)
-        if not os.path.exists(i_plan_dir):
-            os.makedirs(i_plan_dir)
-
         filepath = os.path.join(i_plan_dir,
                                 str(i) + "." + str(output_options_plot.get('format', 'png')))
 
@@ -311,7 +338,7 @@ def run_benchmark(scenario: Scenario, save_directory: str, instance_name: str,
         geodatadisplay.axes.get_figure().set_size_inches(*output_options_plot.get('size', (15, 10)))
         geodatadisplay.axes.get_figure().savefig(filepath, dpi=output_options_plot.get('dpi', 150),
                                                  bbox_inches='tight')
-        matplotlib.pyplot.close(geodatadisplay.axes.get_figure())
+        geodatadisplay.close()
 
     del search_result
 
@@ -325,14 +352,14 @@ def generate_scenario_newsletter():
     uav_bases = [Waypoint(area.xmin + 100, area.ymax - 100, 100., 0.)]
 
     num_ignitions = 1
-    wind_speed = random.choice([10., ])  # 18 km/h, 36 km/h, 54 km/h, 72 km/h
-    wind_dir = random.choice([np.pi / 4, ])
+    wind_speed = _choice([10., ])  # 18 km/h, 36 km/h, 54 km/h, 72 km/h
+    wind_dir = _choice([np.pi / 4, ])
     area_range = (area.xmax - area.xmin, area.ymax - area.ymin)
-    ignitions = [
-        TimedPoint(random.uniform(area.xmin + area_range[0] * .2, area.xmax - area_range[0] * .4),
-                   random.uniform(area.ymin + area_range[1] * .4, area.ymax - area_range[1] * .6),
-                   random.uniform(0, 3000))
-        for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin + area_range[0] * .2, area.xmax - area_range[0] * .4),
+        y_range=(area.ymin + area_range[1] * .4, area.ymax - area_range[1] * .6),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
@@ -344,7 +371,7 @@ def generate_scenario_newsletter():
         max_flight_time = 450
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -360,14 +387,14 @@ def generate_scenario_utility_test():
     uav_bases = [Waypoint(area.xmin + 100, area.ymin + 100, 0., 0.)]
 
     num_ignitions = 1
-    wind_speed = random.choice([5., 10., 15., 20.])  # 18 km/h, 36 km/h, 54 km/h, 72 km/h
-    wind_dir = random.choice([0., np.pi / 2, np.pi, 3 * np.pi / 4])
+    wind_speed = _choice([5., 10., 15., 20.])  # 18 km/h, 36 km/h, 54 km/h, 72 km/h
+    wind_dir = _choice([0., np.pi / 2, np.pi, 3 * np.pi / 4])
     area_range = (area.xmax - area.xmin, area.ymax - area.ymin)
-    ignitions = [
-        TimedPoint(random.uniform(area.xmin + area_range[0] * .1, area.xmax - area_range[0] * .1),
-                   random.uniform(area.ymin + area_range[1] * .1, area.ymax - area_range[1] * .1),
-                   random.uniform(0, 3000))
-        for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin + area_range[0] * .1, area.xmax - area_range[0] * .1),
+        y_range=(area.ymin + area_range[1] * .1, area.ymax - area_range[1] * .1),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
@@ -375,11 +402,11 @@ def generate_scenario_utility_test():
     num_flights = 1
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start + 2500, start + 7500.)
-        max_flight_time = random.uniform(1000, 1500)
+        uav_start = _uniform(start + 2500, start + 7500.)
+        max_flight_time = _uniform(1000, 1500)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -395,14 +422,14 @@ def generate_scenario_singlefire_singleuav_3d():
     uav_bases = [Waypoint(area.xmin + 100, area.ymin + 100, 100., 0.)]
 
     num_ignitions = 1
-    wind_speed = random.choice([5., 10., 15., 20.])  # 18 km/h, 36 km/h, 54 km/h, 72 km/h
-    wind_dir = random.choice([0., np.pi / 2, np.pi, 3 * np.pi / 4])
+    wind_speed = _choice([5., 10., 15., 20.])  # 18 km/h, 36 km/h, 54 km/h, 72 km/h
+    wind_dir = _choice([0., np.pi / 2, np.pi, 3 * np.pi / 4])
     area_range = (area.xmax - area.xmin, area.ymax - area.ymin)
-    ignitions = [
-        TimedPoint(random.uniform(area.xmin + area_range[0] * .1, area.xmax - area_range[0] * .1),
-                   random.uniform(area.ymin + area_range[1] * .1, area.ymax - area_range[1] * .1),
-                   random.uniform(0, 3000))
-        for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin + area_range[0] * .1, area.xmax - area_range[0] * .1),
+        y_range=(area.ymin + area_range[1] * .1, area.ymax - area_range[1] * .1),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
@@ -410,11 +437,11 @@ def generate_scenario_singlefire_singleuav_3d():
     num_flights = 1
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start + 2500, start + 7500.)
-        max_flight_time = random.uniform(1000, 1500)
+        uav_start = _uniform(start + 2500, start + 7500.)
+        max_flight_time = _uniform(1000, 1500)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -434,10 +461,11 @@ def generate_scenario_singlefire_singleuav_shortrange():
     num_ignitions = 1
     x_area_range = area.xmax - area.xmin
     y_area_range = area.ymax - area.ymin
-    ignitions = [TimedPoint(random.uniform(area.xmin, area.xmax - 0.5 * x_area_range),
-                            random.uniform(area.ymin, area.ymax - 0.5 * y_area_range),
-                            random.uniform(0, 3000))
-                 for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin, area.xmax - 0.5 * x_area_range),
+        y_range=(area.ymin, area.ymax - 0.5 * y_area_range),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
@@ -445,11 +473,11 @@ def generate_scenario_singlefire_singleuav_shortrange():
     num_flights = 1
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start + 5000, start + 7000.)
-        max_flight_time = random.uniform(500, 1000)
+        uav_start = _uniform(start + 5000, start + 7000.)
+        max_flight_time = _uniform(500, 1000)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -467,10 +495,11 @@ def generate_scenario_singlefire_singleuav():
     wind_speed = 15.
     wind_dir = 0.
     num_ignitions = 1
-    ignitions = [TimedPoint(random.uniform(area.xmin, area.xmax),
-                            random.uniform(area.ymin, area.ymax),
-                            random.uniform(0, 3000))
-                 for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin, area.xmax),
+        y_range=(area.ymin, area.ymax),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
@@ -478,11 +507,11 @@ def generate_scenario_singlefire_singleuav():
     num_flights = 1
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start, start + 4000.)
-        max_flight_time = random.uniform(1000, 1500)
+        uav_start = _uniform(start, start + 4000.)
+        max_flight_time = _uniform(1000, 1500)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -503,23 +532,24 @@ def generate_scenario_lambert93():
 
     wind_speed = 15.  # random.uniform(10., 20.)  # wind speed in [10,20] km/h
     wind_dir = 0.  # random.random() * 2 * np.pi
-    num_ignitions = random.randint(1, 3)
-    ignitions = [TimedPoint(random.uniform(area.xmin, area.xmax),
-                            random.uniform(area.ymin, area.ymax),
-                            random.uniform(0, 3000))
-                 for i in range(num_ignitions)]
+    num_ignitions = _randint(1, 3)
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin, area.xmax),
+        y_range=(area.ymin, area.ymax),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
 
-    num_flights = random.randint(1, 3)
+    num_flights = _randint(1, 3)
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start, start + 4000.)
-        max_flight_time = random.uniform(500, 1200)
+        uav_start = _uniform(start, start + 4000.)
+        max_flight_time = _uniform(500, 1200)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -540,27 +570,28 @@ def generate_scenario_few():
         Waypoint(area.xmax - 100, area.ymax - 100, 0, 0)
     ]
 
-    wind_speed = random.uniform(5., 10.)  # wind speed in [10,20] km/h
-    wind_dir = random.random() * 2 * np.pi
-    num_ignitions = random.randint(2, 4)
+    wind_speed = _uniform(5., 10.)  # wind speed in [10,20] km/h
+    wind_dir = _uniform(0., 2 * np.pi)
+    num_ignitions = _randint(2, 4)
 
     # Calculate a safe area for the ignitions
-    ignitions = [TimedPoint(random.uniform(area.xmin + 100, area.xmax - 100),
-                            random.uniform(area.ymin + 100, area.ymax - 100),
-                            random.uniform(0, 3600))
-                 for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin + 100, area.xmax - 100),
+        y_range=(area.ymin + 100, area.ymax - 100),
+        time_range=(0, 3600))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
 
-    num_flights = random.randint(2,4)
+    num_flights = _randint(2,4)
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start + 7100., start + 7300.)
-        max_flight_time = random.uniform(1200, 2400)
+        uav_start = _uniform(start + 7100., start + 7300.)
+        max_flight_time = _uniform(1200, 2400)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -581,27 +612,28 @@ def generate_scenario_dozens():
         Waypoint(area.xmax - 100, area.ymax - 100, 0, 0)
     ]
 
-    wind_speed = random.uniform(5., 10.)  # wind speed in [10,20] km/h
-    wind_dir = random.random() * 2 * np.pi
-    num_ignitions = random.randint(10, 14)
+    wind_speed = _uniform(5., 10.)  # wind speed in [10,20] km/h
+    wind_dir = _uniform(0., 2 * np.pi)
+    num_ignitions = _randint(10, 14)
 
     # Calculate a safe area for the ignitions
-    ignitions = [TimedPoint(random.uniform(area.xmin + 100, area.xmax - 100),
-                            random.uniform(area.ymin + 100, area.ymax - 100),
-                            random.uniform(0, 6000))
-                 for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin + 100, area.xmax - 100),
+        y_range=(area.ymin + 100, area.ymax - 100),
+        time_range=(0, 6000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
 
-    num_flights = random.randint(10, 14)
+    num_flights = _randint(10, 14)
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start + 3999., start + 4000.)
-        max_flight_time = random.uniform(500, 1200)
+        uav_start = _uniform(start + 3999., start + 4000.)
+        max_flight_time = _uniform(500, 1200)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -622,30 +654,30 @@ def generate_scenario_big_fire():
         Waypoint(area.xmax - 100, area.ymax - 100, 0, 0)
     ]
 
-    wind_speed = random.uniform(1., 2.)  # wind speed in [10,20] km/h
-    wind_dir = random.random() * 2 * np.pi
-    num_ignitions = random.randint(1, 1)
+    wind_speed = _uniform(1., 2.)  # wind speed in [10,20] km/h
+    wind_dir = _uniform(0., 2 * np.pi)
+    num_ignitions = _randint(1, 1)
 
     # Calculate a safe area for the ignitions
     allowed_range_x = (area.xmax - area.xmin) * 0.25
     allowed_range_y = (area.ymax - area.ymin) * 0.25
-    ignitions = [
-        TimedPoint(random.uniform(area.xmin + allowed_range_x, area.xmax - allowed_range_x),
-                   random.uniform(area.ymin + allowed_range_y, area.ymax - allowed_range_y),
-                   random.uniform(0, 0))
-        for i in range(num_ignitions)]
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin + allowed_range_x, area.xmax - allowed_range_x),
+        y_range=(area.ymin + allowed_range_y, area.ymax - allowed_range_y),
+        time_range=(0, 0))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
 
-    num_flights = random.randint(1, 5)
+    num_flights = _randint(1, 5)
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start + 50000., start + 50000.)
-        max_flight_time = random.uniform(500, 1200)
+        uav_start = _uniform(start + 50000., start + 50000.)
+        max_flight_time = _uniform(500, 1200)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -667,23 +699,24 @@ def generate_scenario():
 
     wind_speed = 15.  # random.uniform(10., 20.)  # wind speed in [10,20] km/h
     wind_dir = 0.  # random.random() * 2 * np.pi
-    num_ignitions = random.randint(1, 3)
-    ignitions = [TimedPoint(random.uniform(area.xmin, area.xmax),
-                            random.uniform(area.ymin, area.ymax),
-                            random.uniform(0, 3000))
-                 for i in range(num_ignitions)]
+    num_ignitions = _randint(1, 3)
+    ignitions = _random_ignitions(
+        num_ignitions,
+        x_range=(area.xmin, area.xmax),
+        y_range=(area.ymin, area.ymax),
+        time_range=(0, 3000))
 
     # start once all fires are ignited
     start = max([igni.time for igni in ignitions])
 
-    num_flights = random.randint(1, 3)
+    num_flights = _randint(1, 3)
     flights = []
     for i in range(num_flights):
-        uav_start = random.uniform(start, start + 4000.)
-        max_flight_time = random.uniform(500, 1200)
+        uav_start = _uniform(start, start + 4000.)
+        max_flight_time = _uniform(500, 1200)
         name = " ".join(("UAV", str(i)))
         uav = UAV("x8-06", uav_speed, uav_max_turn_rate, uav_max_pitch_angle)
-        flights.append(FlightConf(name, uav, uav_start, max_flight_time, random.choice(uav_bases)))
+        flights.append(FlightConf(name, uav, uav_start, max_flight_time, _choice(uav_bases)))
 
     scenario = Scenario(((area.xmin, area.xmax), (area.ymin, area.ymax)),
                         wind_speed, wind_dir, ignitions, flights)
@@ -730,7 +763,8 @@ def run_command(args):
     output_options['data']['save_rasters'] = args.save_rasters
 
     # Scenario loading / generation
-    scenarios = pickle.load(open(os.path.join(args.scenario, 'scenario'), 'rb'))
+    with open(os.path.join(args.scenario, 'scenario'), 'rb') as scenario_f:
+        scenarios = pickle.load(scenario_f)
 
     # Current date and time string
     run_id = datetime.datetime.now(pytz.timezone('UTC')).isoformat()
@@ -768,7 +802,9 @@ def run_command(args):
     else:
         to_run = enumerate(scenarios)
 
-    joblib.Parallel(n_jobs=args.parallel, backend="threading", verbose=5)\
+    # Instances are CPU bound and independent from each other, so run them in separate processes
+    # to avoid being serialized by the GIL. Each one writes its own result files.
+    joblib.Parallel(n_jobs=args.parallel, backend="multiprocessing", verbose=5)\
         (joblib.delayed(run_benchmark)(s, run_dir, str(i),
                                        output_options_plot=output_options['plot'],
                                        snapshots=args.snapshots,
@@ -825,16 +861,11 @@ def create_command(args):
         # 10-minute mark (minus 1). This makes color bar ranges and fire front contour plots nicer
         ignitions['ignition'][ignitions['ignition'] > \
                               int(scen.time_window_end / 60. + 5) * 60. - 60] = _DBL_MAX
-        # Representation of unburned cells using max double is not suitable for display,
-        # so those values must be converted to NaN
-        ignitions_nan = ignitions['ignition'].copy()
-        ignitions_nan[ignitions_nan == _DBL_MAX] = np.nan
-        first_ignition = np.nanmin(ignitions_nan)
-        last_ignition = np.nanmax(ignitions_nan)
+        first_ignition, last_ignition = _ignition_time_range(ignitions['ignition'])
 
         # Create the geodatadisplay object & extensions that are going to be used
-        geodatadisplay = GeoDataDisplay.pyplot_figure(env.raster.combine(ignitions),
-                                                      frame=(0, 0))
+        geodatadisplay = GeoDataDisplay.agg_figure(env.raster.combine(ignitions),
+                                                   frame=(0, 0))
         geodatadisplay.add_extension(TrajectoryDisplayExtension, (None,), {})
 
         plot_plan_with_background(final_plan, geodatadisplay, (first_ignition, last_ignition),
@@ -851,6 +882,8 @@ def create_command(args):
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
+    if args.seed is not None:
+        _rng.seed(args.seed)
     _logger.info("Using factory %s to create %d scenario instances in %s", args.factory,
                  args.n_instances, args.output)
     scenario_generator = None
@@ -863,7 +896,7 @@ def create_command(args):
         scenario_generator = scenario_factory_funcs[args.factory]
     scenarios = [scenario_generator() for i in range(args.n_instances)]
     with open(os.path.join(args.output, 'scenario'), 'wb+') as scenario_f:
-        pickle.dump(scenarios, scenario_f)
+        pickle.dump(scenarios, scenario_f, protocol=pickle.HIGHEST_PROTOCOL)
 
     with open(os.path.join(args.output, 'scenario_digest.txt'), 'w') as scenario_f:
         for s in scenarios:
@@ -905,6 +938,10 @@ def main():
                                help="Number of scenario instances to generate",
                                type=int,
                                default=40)
+    parser_create.add_argument("--seed",
+                               help="Seed of the random generator of the scenario factories",
+                               type=int,
+                               default=None)
     parser_create.add_argument('--factory-collection',
                                help="Name of a custom factory python module",
                                default=None)
@@ -989,7 +1026,7 @@ def main():
                             help="Save snapshots of the plan after every improvement. Beware, this option will slowdown the simulation and consume lots of memory",
                             default=False)
     parser_run.add_argument("--parallel",
-                            help="Set the number of threads to be used for parallel processing.",
+                            help="Set the number of processes to be used for parallel processing.",
                             type=int,
                             default=1)
     parser_run.add_argument('--save-rasters', dest='save_rasters', action='store_true',
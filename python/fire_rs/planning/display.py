@@ -25,7 +25,7 @@
 import logging
 import types
 
-from itertools import cycle
+from itertools import chain, cycle
 from typing import List, Optional, Sequence, Tuple, Union
 
 import matplotlib.cm
@@ -41,6 +41,14 @@ logger = logging.getLogger(__name__)
 
 TRAJECTORY_COLORS = ["darkgreen", "darkblue", "darkorange", "darkmagenta", "darkred"]
 
+FLIGHTTIME_CMAP = matplotlib.cm.plasma
+
+
+def _xy_array(points) -> 'np.ndarray':
+    """Get the coordinates of a sequence of points (waypoints, ...) as an (N, 2) array."""
+    return np.fromiter(chain.from_iterable((p.x, p.y) for p in points), dtype=float,
+                       count=2 * len(points)).reshape(-1, 2)
+
 
 class TrajectoryDisplayExtension(gdd.DisplayExtension):
     """Extension to GeoDataDisplay that an observation trajectories."""
@@ -80,13 +88,11 @@ class TrajectoryDisplayExtension(gdd.DisplayExtension):
     def draw_waypoints(self, *args, **kwargs):
         """Draw path waypoints in a GeoDataDisplay figure."""
         color = kwargs.get('color', 'C0')
-        waypoints = self.plan_trajectory.as_waypoints()
-        x = [wp.x for wp in waypoints]
-        y = [wp.y for wp in waypoints]
+        xy = _xy_array(self.plan_trajectory.as_waypoints())
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(x[::2], y[::2], s=7, c=color, marker='D'))
+            self._base_display.axes.scatter(xy[::2, 0], xy[::2, 1], s=7, c=color, marker='D'))
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(x[1::2], y[1::2], s=7, c=color, marker='>'))
+            self._base_display.axes.scatter(xy[1::2, 0], xy[1::2, 1], s=7, c=color, marker='>'))
 
     def draw_flighttime_path(self, *args,
                              colorbar_time_range: 'Optional[Tuple[float, float]]' = None,
@@ -103,19 +109,19 @@ class TrajectoryDisplayExtension(gdd.DisplayExtension):
 
         label = kwargs.get('label', None)
 
-        sampled_waypoints = self.plan_trajectory.sampled(step_size=5)
-        x = [wp.x for wp in sampled_waypoints]
-        y = [wp.y for wp in sampled_waypoints]
+        xy = _xy_array(self.plan_trajectory.sampled(step_size=5))
         color_range = np.linspace(self.plan_trajectory.start_time() / 60,
-                                  self.plan_trajectory.end_time() / 60, len(x))
-        color_norm = matplotlib.colors.Normalize(vmin=color_range[0], vmax=color_range[-1])
+                                  self.plan_trajectory.end_time() / 60, len(xy))
         if colorbar_time_range is not None:
             color_norm = matplotlib.colors.Normalize(vmin=colorbar_time_range[0] / 60,
                                                      vmax=colorbar_time_range[1] / 60)
+        else:
+            color_norm = matplotlib.colors.Normalize(vmin=color_range[0], vmax=color_range[-1])
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(x, y, s=1, edgecolors='none', c=color_range,
+            self._base_display.axes.scatter(xy[:, 0], xy[:, 1], s=1, edgecolors='none',
+                                            c=color_range,
                                             label=label, norm=color_norm,
-                                            cmap=matplotlib.cm.plasma,
+                                            cmap=FLIGHTTIME_CMAP,
                                             zorder=self._base_display.FOREGROUND_LAYER))
         if kwargs.get('with_colorbar', False):
             cb = self._base_display.figure.colorbar(self._base_display.drawings[-1],
@@ -142,14 +148,14 @@ class TrajectoryDisplayExtension(gdd.DisplayExtension):
 
         sampled_waypoints = traj.sampled_with_time(time_range, step_size=5)
 
-        x = [wp.x for i, wp in enumerate(sampled_waypoints[0]) if
-             time_range[0] < sampled_waypoints[1][i] < time_range[1]]
-        y = [wp.y for i, wp in enumerate(sampled_waypoints[0]) if
-             time_range[0] < sampled_waypoints[1][i] < time_range[1]]
+        xy = _xy_array(sampled_waypoints[0])
+        times = np.asarray(sampled_waypoints[1], dtype=float)
+        xy = xy[(time_range[0] < times) & (times < time_range[1])]
 
         self._base_display.drawings.append(
-            self._base_display.axes.plot(x, y, linewidth=size, linestyle=linestyle, c=color,
-                                         label=label, zorder=self._base_display.FOREGROUND_LAYER))
+            self._base_display.axes.plot(xy[:, 0], xy[:, 1], linewidth=size, linestyle=linestyle,
+                                         c=color, label=label,
+                                         zorder=self._base_display.FOREGROUND_LAYER))
         # TODO: implement legend
 
     def draw_waypoint_trail(self, wp_trail, **kwargs):
@@ -176,75 +182,58 @@ class TrajectoryDisplayExtension(gdd.DisplayExtension):
         time_range = kwargs.get('time_range', (-np.inf, np.inf))
 
         py_segments = [s for s in self.plan_trajectory.segments]
+        n = len(py_segments)
+        if n == 0:
+            return
 
-        py_modifi_segments = [s for i, s in enumerate(py_segments) if
-                              self.plan_trajectory.can_modify(i) and
-                              time_range[0] <= self.plan_trajectory.start_time(i) <= time_range[1]]
-        py_frozen_segments = [s for i, s in enumerate(py_segments) if
-                              not self.plan_trajectory.can_modify(i) and
-                              time_range[0] <= self.plan_trajectory.start_time(i) <= time_range[1]]
+        start_times = np.fromiter((self.plan_trajectory.start_time(i) for i in range(n)),
+                                  dtype=float, count=n)
+        in_range = (time_range[0] <= start_times) & (start_times <= time_range[1])
+        modifiable = np.fromiter((self.plan_trajectory.can_modify(i) for i in range(n)),
+                                 dtype=bool, count=n)
+        is_base = np.zeros(n, dtype=bool)
+        is_base[[0, -1]] = True
 
-        # Plot modifiable segments
-        start_x_m = [s.start.x for s in py_modifi_segments]
-        start_y_m = [s.start.y for s in py_modifi_segments]
-        end_x_m = [s.end.x for s in py_modifi_segments]
-        end_y_m = [s.end.y for s in py_modifi_segments]
+        starts = _xy_array([s.start for s in py_segments])
+        ends = _xy_array([s.end for s in py_segments])
 
+        # Plot modifiable segments
+        modifi = in_range & modifiable
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(start_x_m, start_y_m, s=10, edgecolor='black', c=color,
-                                            marker='o',
+            self._base_display.axes.scatter(starts[modifi, 0], starts[modifi, 1], s=10,
+                                            edgecolor='black', c=color, marker='o',
                                             zorder=self._base_display.FOREGROUND_OVERLAY_LAYER))
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(end_x_m, end_y_m, s=10, edgecolor='black', c=color,
-                                            marker='>',
+            self._base_display.axes.scatter(ends[modifi, 0], ends[modifi, 1], s=10,
+                                            edgecolor='black', c=color, marker='>',
                                             zorder=self._base_display.FOREGROUND_OVERLAY_LAYER))
 
         # Plot frozen segments (all but the bases)
-        start_x_f = [s.start.x for s in py_frozen_segments if
-                     not (s == py_segments[0] or s == py_segments[-1])]
-        start_y_f = [s.start.y for s in py_frozen_segments if
-                     not (s == py_segments[0] or s == py_segments[-1])]
-        end_x_f = [s.end.x for s in py_frozen_segments if
-                   not (s == py_segments[0] or s == py_segments[-1])]
-        end_y_f = [s.end.y for s in py_frozen_segments if
-                   not (s == py_segments[0] or s == py_segments[-1])]
-
+        frozen = in_range & ~modifiable & ~is_base
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(start_x_f, start_y_f, s=10, edgecolor='black',
-                                            c='black', marker='o',
+            self._base_display.axes.scatter(starts[frozen, 0], starts[frozen, 1], s=10,
+                                            edgecolor='black', c='black', marker='o',
                                             zorder=self._base_display.FOREGROUND_OVERLAY_LAYER))
         self._base_display.drawings.append(
-            self._base_display.axes.scatter(end_x_f, end_y_f, s=10, edgecolor='black', c='black',
-                                            marker='>',
+            self._base_display.axes.scatter(ends[frozen, 0], ends[frozen, 1], s=10,
+                                            edgecolor='black', c='black', marker='>',
                                             zorder=self._base_display.FOREGROUND_OVERLAY_LAYER))
 
-        if time_range[0] <= self.plan_trajectory.start_time(0) <= time_range[1]:
-            start_base = py_segments[0]
+        if in_range[0]:
             self._base_display.drawings.append(self._base_display.axes.scatter(
-                start_base.start.x, start_base.start.y, s=10, edgecolor=color, c=color, marker='D',
+                starts[0, 0], starts[0, 1], s=10, edgecolor=color, c=color, marker='D',
                 zorder=self._base_display.FOREGROUND_OVERLAY_LAYER))
 
-        if time_range[0] <= self.plan_trajectory.start_time(len(self.plan_trajectory) - 1) <= \
-                time_range[1]:
-            finish_base = py_segments[-1]
+        if in_range[-1]:
             self._base_display.drawings.append(
-                self._base_display.axes.scatter(finish_base.start.x, finish_base.start.y, s=10,
+                self._base_display.axes.scatter(starts[-1, 0], starts[-1, 1], s=10,
                                                 edgecolor=color, c=color, marker='D',
                                                 zorder=self._base_display.FOREGROUND_OVERLAY_LAYER))
 
-        start_x = [s.start.x for i, s in enumerate(py_segments) if
-                   time_range[0] <= self.plan_trajectory.start_time(i) <= time_range[1]]
-        start_y = [s.start.y for i, s in enumerate(py_segments) if
-                   time_range[0] <= self.plan_trajectory.start_time(i) <= time_range[1]]
-        end_x = [s.end.x for i, s in enumerate(py_segments) if
-                 time_range[0] <= self.plan_trajectory.start_time(i) <= time_range[1]]
-        end_y = [s.end.y for i, s in enumerate(py_segments) if
-                 time_range[0] <= self.plan_trajectory.start_time(i) <= time_range[1]]
-
         # Draw lines between segment bounds
-        for i in range(len(start_x)):
+        for (start_x, start_y), (end_x, end_y) in zip(starts[in_range], ends[in_range]):
             self._base_display.drawings.append(
-                self._base_display.axes.plot([start_x[i], end_x[i]], [start_y[i], end_y[i]],
+                self._base_display.axes.plot([start_x, end_x], [start_y, end_y],
                                              c=color, linewidth=2,
                                              zorder=self._base_display.FOREGROUND_LAYER))
 
@@ -1,75 +1,497 @@
+import base64
+import collections
+import concurrent.futures
+import logging
 import numpy as np
-import skimage.io
-import skimage.draw
+import os
 import skimage.measure
 import tempfile
+import weakref
+import zlib
 
 import pymorse
+import scipy.ndimage
+from PIL import Image
+
+try:
+    import contourpy
+except ImportError:
+    contourpy = None
+
+try:
+    import cv2
+except ImportError:  # optional, thick lines are drawn with scipy
+    cv2 = None
+
+try:
+    import numba
+except ImportError:  # optional, the fire front is drawn with NumPy
+    numba = None
+
+try:
+    import cupy
+except ImportError:  # optional, used to draw large fire fronts
+    cupy = None
+
+try:
+    import zstandard
+except ImportError:  # optional, contours are compressed with zlib
+    zstandard = None
 
 from datetime import datetime
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 
 from fire_rs.geodata.geo_data import GeoData
 
+_logger = logging.getLogger(__name__)
+
+# Infinite ignition times (never burning cells) are bounded to this value so that contour
+# generation sees finite values, as scikit-image does.
+_TIME_MAX = np.finfo(np.float64).max
+
+# Side, in cells, of the blocks of the ignition map used to locate the fire front
+_MINMAX_BLOCK_SIZE = 16
+
+# Fire fronts spanning at least this number of cells are drawn on the GPU, if CuPy is available
+_GPU_MIN_CELLS = 4000000
+
+
+# An ignition map and the arrays derived from it. A new map is published by replacing the whole
+# state in a single assignment, so that an update running in another thread sees either the
+# old map or the new one. block_min and block_max are the time range of each block of times,
+# contour_generator the contourpy generator of times, if contourpy is available, and images the
+# two fire images drawn in turn, as [image, region where the front was drawn].
+_FireMapState = collections.namedtuple(
+    '_FireMapState', ['fire_map', 'layer', 'times', 'block_min', 'block_max',
+                      'contour_generator', 'images'])
+
+
+def _block_reduce(z: 'np.ndarray', block_size: 'int', ufunc) -> 'np.ndarray':
+    """Reduce a 2D array over square blocks of block_size cells with ufunc (np.fmin, np.fmax...).
+
+    Each block also covers the first row and column of the next ones, so that any 2x2 group of
+    neighbouring cells, from which a contour segment is computed, lies within a single block.
+    """
+    n0, n1 = z.shape
+    nb0, nb1 = max(1, -(-(n0 - 1) // block_size)), max(1, -(-(n1 - 1) // block_size))
+    # repeating the last row/column does not change the reduction of the last blocks
+    zp = np.pad(z, ((0, nb0 * block_size + 1 - n0), (0, nb1 * block_size + 1 - n1)), mode='edge')
+    rows = ufunc(ufunc.reduce(zp[:-1].reshape(nb0, block_size, -1), axis=1),
+                 zp[block_size::block_size])
+    return ufunc(ufunc.reduce(rows[:, :-1].reshape(nb0, nb1, block_size), axis=2),
+                 rows[:, block_size::block_size])
+
+
+def _level_crossings(z: 'np.ndarray', level: 'float', xp=np) -> 'np.ndarray':
+    """Cells of z where the contour lines at level are drawn, as a boolean array.
+
+    A contour point lies on each edge between two neighbouring cells whose values are on both
+    sides of level, at the position interpolated by skimage.measure.find_contours. Truncated to
+    a cell, the point falls on the first cell of the edge, or on the second one when the
+    interpolation rounds to it: when the second cell is exactly at the level, or when the first
+    one is much further from the level, such as unburned cells bounded to _TIME_MAX. Linking the
+    points of a contour cell by cell draws exactly these cells.
+    :param xp: array module of z, numpy or cupy
+    """
+    above = z > level
+    crossings = xp.zeros(z.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for axis in (0, 1):
+            first = (slice(None, -1), slice(None)) if axis == 0 else (slice(None), slice(None, -1))
+            second = (slice(1, None), slice(None)) if axis == 0 else (slice(None), slice(1, None))
+            edges = above[first] != above[second]
+            # position of the point along the edge, as find_contours computes it
+            index = xp.arange(z.shape[axis] - 1, dtype=z.dtype)
+            index = index[:, None] if axis == 0 else index[None, :]
+            position = index + (level - z[first]) / (z[second] - z[first])
+            on_second = position >= index + 1
+            crossings[first] |= edges & ~on_second
+            crossings[second] |= edges & on_second
+    return crossings
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _on_second_cell(index, first, second, level):
+        """Whether the contour point between two cells truncates to the second one."""
+        return index + (level - first) / (second - first) >= index + 1
+
+    @numba.njit(cache=True, parallel=True)
+    def _draw_level_crossings(z, level, blocks, block_size, color, img):
+        """Draw in img the cells of z given by _level_crossings, without temporary arrays.
+
+        Only the cells of the given (row, column) blocks of block_size cells are processed. As in
+        _block_reduce, the last blocks also cover the last row and column of z when no other block
+        starts there.
+        """
+        n0, n1 = z.shape
+        for k in numba.prange(blocks.shape[0]):
+            stop0 = (blocks[k, 0] + 1) * block_size
+            stop0 = n0 if stop0 >= n0 - 1 else stop0
+            stop1 = (blocks[k, 1] + 1) * block_size
+            stop1 = n1 if stop1 >= n1 - 1 else stop1
+            for i in range(blocks[k, 0] * block_size, stop0):
+                for j in range(blocks[k, 1] * block_size, stop1):
+                    above = z[i, j] > level
+                    if j + 1 < n1 and above != (z[i, j + 1] > level):
+                        jj = j + 1 if _on_second_cell(float(j), z[i, j], z[i, j + 1], level) \
+                            else j + 0
+                        for b in range(color.size):
+                            img[i, jj, b] = color[b]
+                    if i + 1 < n0 and above != (z[i + 1, j] > level):
+                        ii = i + 1 if _on_second_cell(float(i), z[i, j], z[i + 1, j], level) \
+                            else i + 0
+                        for b in range(color.size):
+                            img[ii, j, b] = color[b]
+
+
+def encode_contours(contours: 'List[np.ndarray]') -> 'Tuple[str, str]':
+    """Compact encoding of contours of (row, column) cell coordinates.
+
+    Coordinates are truncated to integers, as when drawing the contours. The encoded bytes are
+    a little-endian int32 array: the number of contours, the number of points of each contour,
+    then for each contour its first point followed by the difference of each point with the
+    previous one. The bytes are compressed and base64 encoded.
+    :return: (compression, data) where compression is 'zstd' or 'zlib'
+    """
+    parts = [np.array([len(contours)] + [len(c) for c in contours])]
+    for c in contours:
+        points = c.astype(np.int64)
+        parts.append(np.concatenate((points[:1], points[1:] - points[:-1])).ravel())
+    raw = np.concatenate(parts).astype('<i4').tobytes()
+    if zstandard is not None:
+        return 'zstd', base64.b64encode(zstandard.ZstdCompressor(level=1).compress(raw)).decode()
+    return 'zlib', base64.b64encode(zlib.compress(raw, 1)).decode()
+
 
 class MorseWildfire:
-    """Communicate with Morse to display a fire in the scene"""
+    """Communicate with Morse to display a fire in the scene
 
-    def __init__(self, address: 'Tuple[str, int]', terrain_object: 'str'):
+    By default the fire front is drawn in a texture of the terrain object. With send_contours,
+    the contours are sent instead, as encoded by encode_contours, to a "set_contours" service of
+    the Morse simulation: set_contours(terrain_object, shape, compression, data), where shape is
+    the (rows, columns) shape of the fire map. With a contour_stride above 1, only one point out
+    of contour_stride of each contour is sent.
+    """
+
+    def __init__(self, address: 'Tuple[str, int]', terrain_object: 'str',
+                 send_contours: 'bool' = False, contour_stride: 'int' = 1):
         self.address = address
         self.terrain_object = terrain_object
+        self._terrain_str = str(terrain_object)
+        self.send_contours = send_contours
+        self.contour_stride = contour_stride
 
-        self.fire_map = None
-        self.layer = None
+        self._state = None  # type: Optional[_FireMapState]
+        self._dev_times = None  # (ignition times, copy in GPU memory), with CuPy
+        self._use_gpu = cupy is not None  # until there is no usable CUDA device
 
         self.fire_image = None
         self.color = (255, 255, 255)
+        self.line_thickness = 1  # in cells
+        self._sent_image = None  # last fire image sent to Morse
+        self._sent_contours = None  # last encoded contours sent to Morse
+        self._pending_frame = None  # (image, contours) being sent to Morse
 
         self.morse_conn = None  # type: Optional[pymorse.Morse]
         self._morse_timeout = 5.
 
+        # Every texture update overwrites the same file, removed with the object or at exit
+        fd, self._texture_path = tempfile.mkstemp(suffix=".png", prefix="morse_wildfire_")
+        os.close(fd)
+        weakref.finalize(self, os.remove, self._texture_path)
+
+        # Textures are encoded and sent by a worker thread while the next update is computed
+        self._io_executor = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+        self._pending_texture = None  # type: Optional[concurrent.futures.Future]
+
     def close(self, *args):
         """Close Morse connection"""
-        if self.morse_conn is not None:
-            self.morse_conn.close(*args)
-            self.morse_conn = None
+        try:
+            if args:  # closing on error, the last texture does not matter
+                if self._pending_texture is not None:
+                    self._pending_texture.cancel()
+                    concurrent.futures.wait([self._pending_texture])
+                self._pending_texture = None
+                self._pending_frame = None
+            else:
+                self._finish_pending(wait=True)
+        finally:
+            if self._io_executor is not None:
+                self._io_executor.shutdown()
+                self._io_executor = None
+            if self.morse_conn is not None:
+                self.morse_conn.close(*args)
+                self.morse_conn = None
+
+    @property
+    def fire_map(self) -> 'Optional[GeoData]':
+        """The wildfire ignition time map"""
+        return self._state.fire_map if self._state is not None else None
+
+    @property
+    def layer(self) -> 'Optional[str]':
+        """Layer of the ignition times in fire_map"""
+        return self._state.layer if self._state is not None else None
 
     def set_wildfire_prediction_map(self, fire_map: GeoData, layer='ignition'):
-        """Set the wildfire ignition time map"""
-        self.fire_map = fire_map
-        self.layer = layer
-
-    def _update_fire_image(self, time: 'float'):
-        fire_image = np.zeros((*self.fire_map.data.shape, 3), dtype=np.uint8)
-        # Create contour with scikit-image
-        contours = skimage.measure.find_contours(self.fire_map.data[self.layer], time)
-        # Print contour as binary image
-        for contour in contours:
-            for pt_i in range(len(contour)):
-                rr, cc = skimage.draw.line(*np.asarray(contour[pt_i - 1], dtype=int),
-                                           *np.asarray(contour[pt_i], dtype=int))
-                fire_image[rr, cc] = self.color
+        """Set the wildfire ignition time map
+
+        It can be called from another thread than update().
+        """
+        times = np.clip(fire_map.data[layer], -_TIME_MAX, _TIME_MAX)
+        images = [[np.zeros((*times.shape, 3), dtype=np.uint8), None] for _ in range(2)]
+        # The map is static, so the contour generator and the time range of each block of
+        # cells can be shared by all the updates
+        block_min = _block_reduce(times, _MINMAX_BLOCK_SIZE, np.fmin)
+        block_max = _block_reduce(times, _MINMAX_BLOCK_SIZE, np.fmax)
+        contour_generator = None
+        if contourpy is not None:
+            contour_generator = contourpy.contour_generator(
+                z=times, line_type=contourpy.LineType.ChunkCombinedOffset)
+        if numba is not None:
+            # Compile the kernel for these arrays, or load it from the cache, now rather than
+            # during the first update
+            _draw_level_crossings(times, 0., np.empty((0, 2), dtype=np.int64),
+                                  _MINMAX_BLOCK_SIZE, np.zeros(3, dtype=np.uint8),
+                                  np.zeros((0, 0, 3), dtype=np.uint8))
+        # Everything is ready: updates use the new map from now on
+        self._state = _FireMapState(fire_map, layer, times, block_min, block_max,
+                                    contour_generator, images)
+        self._sent_image = None
+        self._sent_contours = None
+
+    @staticmethod
+    def _active_blocks(state: '_FireMapState', time: 'float') -> 'np.ndarray':
+        """(row, column) indices of the blocks of the ignition map where the front may be."""
+        return np.argwhere((state.block_min <= time) & (time <= state.block_max))
+
+    def _front_window(self, state: '_FireMapState', time: 'float',
+                      blocks: 'Optional[np.ndarray]' = None) -> 'Optional[Tuple[slice, slice]]':
+        """Region of the ignition map where the fire front is at a given time, if any."""
+        # Only the cells of the bounding box of the blocks where the front may be are processed
+        if blocks is None:
+            blocks = self._active_blocks(state, time)
+        if not len(blocks):
+            return None
+        low = blocks.min(axis=0) * _MINMAX_BLOCK_SIZE
+        high = (blocks.max(axis=0) + 1) * _MINMAX_BLOCK_SIZE + 1
+        return slice(low[0], high[0]), slice(low[1], high[1])
+
+    def _fire_front(self, state: '_FireMapState',
+                    time: 'float') -> 'Tuple[np.ndarray, np.ndarray]':
+        """Fire front at a given time, as the contours put end to end.
+
+        :return: (points, ends) where points is an (N, 2) array of (row, column) coordinates and
+            the i-th contour ends at points[ends[i]]
+        """
+        no_front = np.empty((0, 2)), np.empty(0, dtype=np.int64)
+        window = self._front_window(state, time)
+        if window is None:
+            return no_front
+
+        if contourpy is not None:
+            if state.times[window].shape == state.times.shape:
+                generator = state.contour_generator
+            else:
+                generator = contourpy.contour_generator(
+                    z=state.times[window], line_type=contourpy.LineType.ChunkCombinedOffset)
+            # a single chunk, with the points of all the contours and their offsets
+            (points,), (offsets,) = generator.lines(time)
+            if points is None:
+                return no_front
+            # contourpy uses (x, y) coordinates, with x along the columns. Points on cell edges
+            # may be off by a rounding error, snap them back so that pixels do not flicker.
+            points = points[:, ::-1]
+            nearest = np.rint(points)
+            points = np.where(np.abs(points - nearest) < 1e-9, nearest, points)
+            ends = offsets[1:].astype(np.int64)
+        else:
+            contours = skimage.measure.find_contours(state.times[window], time)
+            if not contours:
+                return no_front
+            points = np.concatenate(contours)
+            ends = np.cumsum([len(c) for c in contours])
+        return points + np.array([window[0].start, window[1].start]), ends
+
+    def _contours(self, state: '_FireMapState', time: 'float') -> 'List[np.ndarray]':
+        """Fire front at a given time, as (N, 2) arrays of (row, column) coordinates.
+
+        Only one point out of contour_stride is kept, along with the last point of each contour.
+        """
+        points, ends = self._fire_front(state, time)
+        if not len(ends):
+            return []
+        if self.contour_stride > 1:
+            starts = np.concatenate(([0], ends[:-1]))
+            contour = np.repeat(np.arange(len(ends)), ends - starts)
+            index = np.arange(len(points))
+            kept = ((index - starts[contour]) % self.contour_stride == 0)
+            kept[ends - 1] = True
+            points = points[kept]
+            ends = np.cumsum(np.bincount(contour[kept], minlength=len(ends)))
+        return np.split(points, ends[:-1])
+
+    def _update_fire_image(self, state: '_FireMapState', time: 'float'):
+        # Two images are drawn in turn, so that the last one sent to Morse is kept for comparison.
+        # Only the region where the front was drawn on an image is cleared before reusing it.
+        last_image = self._last_frame()[0]
+        image_drawn = state.images[0] if state.images[0][0] is not last_image \
+            else state.images[1]
+        fire_image, drawn = image_drawn
+        if drawn is not None:
+            fire_image[drawn] = 0
+        image_drawn[1] = None
+
+        # C-contiguous, the layout the kernel is compiled for
+        blocks = np.ascontiguousarray(self._active_blocks(state, time))
+        window = self._front_window(state, time, blocks)
+        if window is not None:
+            # Draw the fire front as the contours linked cell by cell, without building them
+            image_drawn[1] = window
+            crossings = None
+            if self._use_gpu and state.times[window].size >= _GPU_MIN_CELLS:
+                crossings = self._gpu_level_crossings(state, time, window)
+            if crossings is not None:
+                fire_image[window][crossings] = self.color
+            elif numba is not None:
+                # only the band of blocks crossed by the front, not its whole bounding box
+                _draw_level_crossings(state.times, time, blocks, _MINMAX_BLOCK_SIZE,
+                                      np.asarray(self.color, dtype=np.uint8), fire_image)
+            else:
+                fire_image[window][_level_crossings(state.times[window], time)] = self.color
+
+            if self.line_thickness > 1:
+                # Thick lines are drawn at once by dilating the thin ones
+                margin = self.line_thickness // 2
+                window = tuple(slice(max(0, w.start - margin), w.stop + margin) for w in window)
+                image_drawn[1] = window
+                if cv2 is not None:
+                    fire_image[window] = cv2.dilate(
+                        np.ascontiguousarray(fire_image[window]),
+                        np.ones((self.line_thickness, self.line_thickness), dtype=np.uint8))
+                else:
+                    fire_image[window] = scipy.ndimage.maximum_filter(
+                        fire_image[window], size=(self.line_thickness, self.line_thickness, 1),
+                        mode='constant')
 
         self.fire_image = fire_image
 
+    def _gpu_level_crossings(self, state: '_FireMapState', time: 'float',
+                             window: 'Tuple[slice, slice]') -> 'Optional[np.ndarray]':
+        """_level_crossings of a window of the ignition map computed with CuPy.
+
+        :return: None if the GPU cannot be used, and it is not tried again for this object
+        """
+        try:
+            if self._dev_times is None or self._dev_times[0] is not state.times:
+                self._dev_times = state.times, cupy.asarray(state.times)
+            return cupy.asnumpy(_level_crossings(self._dev_times[1][window], time, xp=cupy))
+        except (RuntimeError, MemoryError) as e:  # CUDA errors, such as no device available
+            _logger.warning("Drawing the fire front without CuPy: %s", e)
+            self._use_gpu = False
+            self._dev_times = None
+            return None
+
     def update(self, time: 'Optional[float]' = None):
         """Update wildfire texture at current time in morse"""
-        if self.fire_map is None:
+        # The map may be replaced by another thread during the update: use the same one
+        # throughout
+        state = self._state
+        if state is None:
             raise ValueError("The wildfire ignition time map is not set")
 
         if time is None:
             time = datetime.now().timestamp()
 
-        self._update_fire_image(time)
+        # Raise the error of the previous update now, or it would be lost if this frame is the
+        # same
+        self._finish_pending()
 
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=True) as t_file:
-            skimage.io.imsave(t_file, np.transpose(self.fire_image, (1,0,2))[::-1,::1,...])
+        last_image, last_contours = self._last_frame()
+        if self.send_contours:
+            encoded = encode_contours(self._contours(state, time))
+            if last_contours == encoded and self.morse_conn is not None:
+                return
+        else:
+            self._update_fire_image(state, time)
+            # Between two updates the front often moves by less than a cell: the texture is the
+            # same
+            if last_image is not None and self.morse_conn is not None \
+                    and np.array_equal(last_image, self.fire_image):
+                return
+
+        if self._pending_texture is not None:
+            # A frame still waiting for the worker is outdated by this one. One already being
+            # sent cannot be cancelled: wait for it, so that its error, if any, is raised.
+            self._pending_texture.cancel()
+            self._finish_pending(wait=True)
+
+        if self._io_executor is None:
+            self._io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            weakref.finalize(self, self._io_executor.shutdown, False)
+        if self.send_contours:
+            self._pending_texture = self._io_executor.submit(
+                self._send_contours, state.times.shape, encoded)
+            self._pending_frame = None, encoded
+        else:
+            # A grey fire only needs one channel, saved as an 8-bit greyscale PNG
+            if self.color[0] == self.color[1] == self.color[2]:
+                texture = np.transpose(self.fire_image[..., 0])[::-1]
+            else:
+                texture = np.transpose(self.fire_image, (1,0,2))[::-1,::1,...]
+            # The transposition makes a copy, which the worker can use while the next image is
+            # drawn
+            self._pending_texture = self._io_executor.submit(
+                self._send_texture, np.ascontiguousarray(texture))
+            self._pending_frame = self.fire_image, None
 
-            if self.morse_conn is None or not self.morse_conn.is_up():
-                self.morse_conn = pymorse.Morse(*self.address)
+    def _last_frame(self) -> 'Tuple[Optional[np.ndarray], Optional[Tuple[str, str]]]':
+        """(image, encoded contours) being sent to Morse, or else last sent."""
+        if self._pending_frame is not None:
+            return self._pending_frame
+        return self._sent_image, self._sent_contours
 
-            self.morse_conn.rpc_t(self._morse_timeout, "simulation", "set_texture",
-                                  str(self.terrain_object), str(t_file.name))
+    def _finish_pending(self, wait: 'bool' = False):
+        """Record the frame sent by the worker thread, once it is done.
+
+        If it could not be sent, the error is raised and the next frame is sent, even if it is
+        the same.
+        :param wait: wait until the worker is done rather than returning
+        """
+        pending = self._pending_texture
+        if pending is None or not (wait or pending.done()):
+            return
+        self._pending_texture = None
+        frame, self._pending_frame = self._pending_frame, None
+        if pending.cancelled():
+            return
+        try:
+            pending.result()
+        except BaseException:
+            self._sent_image, self._sent_contours = None, None
+            raise
+        self._sent_image, self._sent_contours = frame
+
+    def _send_texture(self, texture: 'np.ndarray'):
+        # The image is mostly empty, the fastest zlib level compresses it well enough
+        Image.fromarray(texture).save(self._texture_path, format='PNG', compress_level=1)
+        self._rpc("set_texture", self._terrain_str, self._texture_path)
+
+    def _send_contours(self, shape: 'Tuple[int, int]', encoded: 'Tuple[str, str]'):
+        self._rpc("set_contours", self._terrain_str, list(shape), *encoded)
+
+    def _rpc(self, service: 'str', *args):
+        """Call a service of the Morse simulation, reconnecting once if the connection failed"""
+        if self.morse_conn is None:
+            self.morse_conn = pymorse.Morse(*self.address)
+        try:
+            self.morse_conn.rpc_t(self._morse_timeout, "simulation", service, *args)
+        except (OSError, concurrent.futures.TimeoutError):
+            if self.morse_conn.is_up():
+                raise
+            self.morse_conn = pymorse.Morse(*self.address)
+            self.morse_conn.rpc_t(self._morse_timeout, "simulation", service, *args)
 
     def __enter__(self):
         if self.morse_conn is None or not self.morse_conn.is_up():
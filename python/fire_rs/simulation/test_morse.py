@@ -0,0 +1,392 @@
+# Copyright (c) 2017, CNRS-LAAS
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#  * Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import base64
+import threading
+import unittest
+import unittest.mock
+import zlib
+
+import numpy as np
+import skimage.measure
+
+import fire_rs.simulation.morse as morse
+from fire_rs.geodata.geo_data import GeoData
+
+
+def _ignition_times(shape, seed=0):
+    """Cone-shaped ignition times with noise, as if the fire started near the map center."""
+    rng = np.random.RandomState(seed)
+    x, y = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    return np.hypot(x - shape[0] / 3, y - shape[1] / 2) * 60 + rng.uniform(0, 30, shape)
+
+
+def _unburned_ignition_times(shape, seed=0):
+    """Ignition times where a part of the map never burns, bounded as in MorseWildfire."""
+    z = _ignition_times(shape, seed)
+    z[shape[0] // 2:shape[0] * 3 // 4, shape[1] // 3:shape[1] * 2 // 3] = np.inf
+    return np.clip(z, -morse._TIME_MAX, morse._TIME_MAX)
+
+
+def _skimage_crossings(z, level):
+    """Cells drawn by linking the points of the skimage contours, as done before."""
+    crossings = np.zeros(z.shape, dtype=bool)
+    for contour in skimage.measure.find_contours(z, level):
+        points = contour.astype(int)
+        crossings[points[:, 0], points[:, 1]] = True
+    return crossings
+
+
+class LevelCrossingsTest(unittest.TestCase):
+
+    def test_same_as_skimage(self):
+        for shape in [(120, 90), (33, 17), (2, 2)]:
+            for z in (_ignition_times(shape), _unburned_ignition_times(shape)):
+                for level in np.linspace(z.min(), z[z < morse._TIME_MAX].max(), 13)[1:-1]:
+                    np.testing.assert_array_equal(morse._level_crossings(z, level),
+                                                  _skimage_crossings(z, level),
+                                                  "shape {}, level {}".format(shape, level))
+
+    def test_level_on_cells(self):
+        # Contour points on cells of the level value, on both sides of them
+        z = np.round(_ignition_times((60, 60)) / 120) * 120
+        for level in [600., 1200., 2400.]:
+            np.testing.assert_array_equal(morse._level_crossings(z, level),
+                                          _skimage_crossings(z, level))
+
+    def test_next_to_unburned_cells(self):
+        # The contour point between a burned cell and an unburned one is on the burned cell,
+        # whichever comes first
+        z = np.array([[0., 10., morse._TIME_MAX, morse._TIME_MAX]])
+        np.testing.assert_array_equal(morse._level_crossings(z, 5.), [[True, False, False, False]])
+        np.testing.assert_array_equal(morse._level_crossings(z, 20.), [[False, True, False, False]])
+        np.testing.assert_array_equal(morse._level_crossings(z[:, ::-1], 20.),
+                                      [[False, False, True, False]])
+        np.testing.assert_array_equal(morse._level_crossings(z.T[::-1], 20.),
+                                      [[False], [False], [True], [False]])
+
+
+class BlockReduceTest(unittest.TestCase):
+
+    def test_same_as_loop(self):
+        bs = morse._MINMAX_BLOCK_SIZE
+        for shape in [(100, 70), (17, 33), (16, 16), (1, 1), (40, 1)]:
+            z = _ignition_times(shape)
+            for ufunc in (np.fmin, np.fmax):
+                reduced = morse._block_reduce(z, bs, ufunc)
+                self.assertEqual(reduced.shape, (max(1, -(-(shape[0] - 1) // bs)),
+                                                 max(1, -(-(shape[1] - 1) // bs))))
+                for (i, j), value in np.ndenumerate(reduced):
+                    # each block overlaps the first row and column of the next ones
+                    block = z[i * bs:(i + 1) * bs + 1, j * bs:(j + 1) * bs + 1]
+                    self.assertEqual(value, ufunc.reduce(block, axis=None))
+
+    def test_covers_the_front(self):
+        # Every cell on the front is in a block of which the time range contains the level
+        bs = morse._MINMAX_BLOCK_SIZE
+        z = _unburned_ignition_times((100, 70))
+        block_min = morse._block_reduce(z, bs, np.fmin)
+        block_max = morse._block_reduce(z, bs, np.fmax)
+        for level in np.linspace(0, 6000, 7)[1:]:
+            active = (block_min <= level) & (level <= block_max)
+            for i, j in np.argwhere(_skimage_crossings(z, level)):
+                blocks = [(bi, bj) for bi in {min(i // bs, active.shape[0] - 1),
+                                              min(max(i - 1, 0) // bs, active.shape[0] - 1)}
+                          for bj in {min(j // bs, active.shape[1] - 1),
+                                     min(max(j - 1, 0) // bs, active.shape[1] - 1)}]
+                self.assertTrue(any(active[b] for b in blocks), (level, i, j))
+
+
+def _decode_contours(compression, data):
+    raw = base64.b64decode(data)
+    raw = zlib.decompress(raw) if compression == 'zlib' else \
+        morse.zstandard.ZstdDecompressor().decompress(raw)
+    values = np.frombuffer(raw, dtype='<i4')
+    lengths = values[1:1 + values[0]]
+    offsets = 1 + values[0] + np.concatenate(([0], np.cumsum(lengths * 2)))
+    return [np.cumsum(values[start:stop].reshape(-1, 2), axis=0)
+            for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+class EncodeContoursTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        z = _unburned_ignition_times((120, 90))
+        contours = skimage.measure.find_contours(z, 3000.) + [np.array([[4.5, 7.25]])]
+        decoded = _decode_contours(*morse.encode_contours(contours))
+        self.assertEqual(len(decoded), len(contours))
+        for c, d in zip(contours, decoded):
+            np.testing.assert_array_equal(d, c.astype(int))
+
+    def test_no_contours(self):
+        self.assertEqual(_decode_contours(*morse.encode_contours([])), [])
+
+
+class FireFrontTest(unittest.TestCase):
+
+    def setUp(self):
+        data = np.zeros((150, 110), dtype=[('ignition', 'float64')])
+        data['ignition'] = _ignition_times(data.shape)
+        data['ignition'][70:110, 40:80] = np.inf
+        self.fire_map = GeoData(data, 0., 0., 25., 25.)
+
+    def _contours(self, time, stride=1):
+        wildfire = morse.MorseWildfire(("localhost", 4000), "terrain", contour_stride=stride)
+        wildfire.set_wildfire_prediction_map(self.fire_map)
+        return wildfire._contours(wildfire._state, time)
+
+    def test_same_as_skimage(self):
+        z = np.clip(self.fire_map.data['ignition'], -morse._TIME_MAX, morse._TIME_MAX)
+        for time in [0., 500., 3000., 5500., 8000.]:
+            expected = skimage.measure.find_contours(z, time)
+            with unittest.mock.patch.object(morse, 'contourpy', None):
+                contours = self._contours(time)
+            self.assertEqual(len(contours), len(expected))
+            for c, e in zip(contours, expected):
+                np.testing.assert_allclose(c, e)
+
+    @unittest.skipIf(morse.contourpy is None, "contourpy is not available")
+    def test_contourpy_same_points_as_skimage(self):
+        # The contours may start at other points or be ordered differently, but go through the
+        # same points
+        for time in [0., 500., 3000., 5500., 8000.]:
+            contours = self._contours(time)
+            with unittest.mock.patch.object(morse, 'contourpy', None):
+                expected = self._contours(time)
+            points = np.concatenate(contours) if contours else np.empty((0, 2))
+            expected = np.concatenate(expected) if expected else np.empty((0, 2))
+            np.testing.assert_allclose(np.unique(np.round(points, 9), axis=0),
+                                       np.unique(np.round(expected, 9), axis=0))
+
+    def test_stride(self):
+        for time in [3000., 5500.]:
+            contours = self._contours(time)
+            strided = self._contours(time, stride=4)
+            self.assertEqual(len(strided), len(contours))
+            for c, s in zip(contours, strided):
+                kept = np.r_[np.arange(0, len(c), 4), len(c) - 1]
+                np.testing.assert_array_equal(s, c[np.unique(kept)])
+
+
+class DrawLevelCrossingsTest(unittest.TestCase):
+
+    @unittest.skipIf(morse.numba is None, "numba is not available")
+    def test_same_as_level_crossings(self):
+        # sides of 16*k+1 cells, where the last row/column is only covered by the last blocks
+        for shape in [(183, 81), (81, 183), (17, 33), (16, 16), (2, 50), (40, 1)]:
+            for z in (_ignition_times(shape), _unburned_ignition_times(shape)):
+                block_min = morse._block_reduce(z, morse._MINMAX_BLOCK_SIZE, np.fmin)
+                all_blocks = np.ascontiguousarray(
+                    np.argwhere(np.ones_like(block_min, dtype=bool)))
+                for level in np.linspace(z.min(), z[z < morse._TIME_MAX].max(), 13)[1:-1]:
+                    img = np.zeros((*shape, 3), dtype=np.uint8)
+                    morse._draw_level_crossings(z, level, all_blocks, morse._MINMAX_BLOCK_SIZE,
+                                                np.array([1, 2, 3], dtype=np.uint8), img)
+                    expected = morse._level_crossings(z, level)
+                    np.testing.assert_array_equal(img[..., 0] == 1, expected,
+                                                  "shape {}, level {}".format(shape, level))
+                    np.testing.assert_array_equal(img[expected], [[1, 2, 3]] * expected.sum())
+
+
+class GpuFallbackTest(unittest.TestCase):
+
+    def test_no_cuda_device(self):
+        # CuPy is installed but there is no device: the front is drawn without it
+        fake_cupy = unittest.mock.Mock()
+        fake_cupy.asarray.side_effect = RuntimeError("cudaErrorNoDevice")
+        data = np.zeros((60, 50), dtype=[('ignition', 'float64')])
+        data['ignition'] = _ignition_times(data.shape)
+        with unittest.mock.patch.object(morse, 'cupy', fake_cupy), \
+                unittest.mock.patch.object(morse, '_GPU_MIN_CELLS', 100):
+            wildfire = morse.MorseWildfire(("localhost", 4000), "terrain")
+            wildfire.set_wildfire_prediction_map(GeoData(data, 0., 0., 25., 25.))
+            fake_cupy.asarray.assert_not_called()  # nothing uploaded until needed
+            with self.assertLogs(morse._logger, 'WARNING'):
+                wildfire._update_fire_image(wildfire._state, 1000.)
+            np.testing.assert_array_equal(wildfire.fire_image[..., 0] > 0,
+                                          morse._level_crossings(wildfire._state.times, 1000.))
+            wildfire._update_fire_image(wildfire._state, 2000.)  # the GPU is not tried again
+            np.testing.assert_array_equal(wildfire.fire_image[..., 0] > 0,
+                                          morse._level_crossings(wildfire._state.times, 2000.))
+            self.assertEqual(fake_cupy.asarray.call_count, 1)
+
+
+class UpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        data = np.zeros((80, 60), dtype=[('ignition', 'float64')])
+        data['ignition'] = _ignition_times(data.shape)
+        self.fire_map = GeoData(data, 0., 0., 25., 25.)
+        patcher = unittest.mock.patch.object(morse.pymorse, 'Morse')
+        self.morse_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rpc = self.morse_class.return_value.rpc_t
+        self.morse_class.return_value.is_up.return_value = True
+
+    def _wildfire(self, **kwargs):
+        wildfire = morse.MorseWildfire(("localhost", 4000), "terrain", **kwargs)
+        wildfire.set_wildfire_prediction_map(self.fire_map)
+        wildfire.__enter__()
+        self.addCleanup(wildfire.close, True)
+        return wildfire
+
+    def test_same_frame_sent_once(self):
+        for send_contours in (False, True):
+            self.rpc.reset_mock()
+            wildfire = self._wildfire(send_contours=send_contours)
+            wildfire.update(1000.)
+            wildfire.update(1000.)
+            wildfire.update(2000.)
+            wildfire.close()
+            self.assertEqual(self.rpc.call_count, 2)
+
+    def _switch_map_during_update(self, wildfire, method):
+        """Set a larger map from another thread when the update calls a method of wildfire"""
+        data = np.zeros((300, 300), dtype=[('ignition', 'float64')])
+        data['ignition'] = _ignition_times(data.shape, seed=1)
+        new_map = GeoData(data, 0., 0., 25., 25.)
+        original = getattr(wildfire, method)
+
+        def switch(*args, **kwargs):
+            if wildfire.fire_map is not new_map:
+                thread = threading.Thread(target=wildfire.set_wildfire_prediction_map,
+                                          args=(new_map,))
+                thread.start()
+                thread.join()
+            return original(*args, **kwargs)
+        return unittest.mock.patch.object(wildfire, method, side_effect=switch)
+
+    def test_map_set_during_update(self):
+        wildfire = self._wildfire()
+        with self._switch_map_during_update(wildfire, '_last_frame'):
+            wildfire.update(1200.)
+        # the update is done on the map it started with
+        self.assertEqual(wildfire.fire_image.shape, (80, 60, 3))
+        np.testing.assert_array_equal(
+            wildfire.fire_image[..., 0] > 0,
+            morse._level_crossings(self.fire_map.data['ignition'], 1200.))
+        wildfire.update(1200.)
+        self.assertEqual(wildfire.fire_image.shape, (300, 300, 3))
+
+    def test_map_set_while_locating_front(self):
+        for send_contours in (False, True):
+            wildfire = self._wildfire(send_contours=send_contours)
+            with self._switch_map_during_update(wildfire, '_active_blocks'):
+                wildfire.update(1200.)
+            wildfire.close()
+            if send_contours:
+                self.assertEqual(self.rpc.call_args[0][4], list(self.fire_map.data.shape))
+            else:
+                np.testing.assert_array_equal(
+                    wildfire.fire_image[..., 0] > 0,
+                    morse._level_crossings(self.fire_map.data['ignition'], 1200.))
+
+    @unittest.skipIf(morse.numba is None, "numba is not available")
+    def test_update_while_map_is_prepared(self):
+        # An update while the new map is being prepared still uses the whole previous one
+        data = np.zeros((80, 60), dtype=[('ignition', 'float64')])
+        data['ignition'] = np.random.RandomState(0).uniform(0, 1000, data.shape)
+        old_map = GeoData(data, 0., 0., 25., 25.)
+        for send_contours in (False, True):
+            wildfire = self._wildfire(send_contours=send_contours)
+            wildfire.set_wildfire_prediction_map(old_map)
+            # the front is everywhere: contours of the whole map, from the shared generator
+            self.assertEqual(wildfire._front_window(wildfire._state, 500.),
+                             (slice(0, 81), slice(0, 65)))
+            errors = []
+
+            def update():
+                try:
+                    wildfire.update(500.)
+                except Exception as e:
+                    errors.append(e)
+
+            kernel = morse._draw_level_crossings
+
+            def warm_up(z, level, blocks, *args):
+                if not len(blocks) and wildfire.fire_map is old_map:
+                    thread = threading.Thread(target=update)
+                    thread.start()
+                    thread.join()
+                return kernel(z, level, blocks, *args)
+            with unittest.mock.patch.object(morse, '_draw_level_crossings', side_effect=warm_up):
+                wildfire.set_wildfire_prediction_map(self.fire_map)
+            wildfire.close()
+            self.assertEqual(errors, [])
+            if send_contours:
+                self.assertEqual(self.rpc.call_args[0][4], list(old_map.data.shape))
+            else:
+                self.assertEqual(wildfire.fire_image.shape, (80, 60, 3))
+                np.testing.assert_array_equal(wildfire.fire_image[..., 0] > 0,
+                                              morse._level_crossings(data['ignition'], 500.))
+
+    def test_error_raised_for_same_frame(self):
+        wildfire = self._wildfire()
+        self.rpc.side_effect = OSError("connection lost")
+        wildfire.update(1000.)
+        wildfire._pending_texture.exception()  # wait for the worker
+        with self.assertRaises(OSError):
+            wildfire.update(1000.)
+
+    def test_failed_frame_sent_again(self):
+        wildfire = self._wildfire()
+        self.rpc.side_effect = OSError("connection lost")
+        wildfire.update(1000.)
+        with self.assertRaises(OSError):
+            wildfire.close()
+        self.rpc.side_effect = None
+        self.rpc.reset_mock()
+        wildfire.update(1000.)
+        wildfire.close()
+        self.assertEqual(self.rpc.call_count, 1)
+
+    def test_error_of_running_frame_raised(self):
+        # A frame which is being sent when the next one is ready is not dropped with its error
+        wildfire = self._wildfire()
+        sending = threading.Event()
+        proceed = threading.Event()
+
+        def rpc(*args):
+            sending.set()
+            proceed.wait(5)
+            raise OSError("connection lost")
+        self.rpc.side_effect = rpc
+        wildfire.update(1000.)
+        sending.wait(5)
+        threading.Timer(0.05, proceed.set).start()
+        with self.assertRaises(OSError):
+            wildfire.update(2000.)
+
+    def test_close_shuts_down_worker(self):
+        wildfire = self._wildfire()
+        wildfire.update(1000.)
+        executor = wildfire._io_executor
+        wildfire.close()
+        self.assertIsNone(wildfire._io_executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+
+
+if __name__ == '__main__':
+    unittest.main()